@@ -0,0 +1,117 @@
+from array import array
+
+# 8-bit ALU results, precomputed at import time.
+#
+# Every entry packs the result and the resulting F register as
+# (F << 8) | result, so a single lookup updates both. Binary operations are
+# indexed by (A << 8) | operand; ADD and SUB (which double as ADC and SBC)
+# take the incoming carry in bit 16 of the index. INC and DEC leave the
+# carry flag alone, so their F value has C cleared and the caller ORs the
+# old carry back in.
+
+FLAG_Z = 0x80
+FLAG_N = 0x40
+FLAG_H = 0x20
+FLAG_C = 0x10
+
+
+def _add(a, b, carry):
+	result = a + b + carry
+	f = 0
+	if result & 0xff == 0:
+		f |= FLAG_Z
+	if (a & 0xf) + (b & 0xf) + carry > 0xf:
+		f |= FLAG_H
+	if result > 0xff:
+		f |= FLAG_C
+	return (f << 8) | (result & 0xff)
+
+
+def _sub(a, b, carry):
+	result = a - b - carry
+	f = FLAG_N
+	if result & 0xff == 0:
+		f |= FLAG_Z
+	if (a & 0xf) - (b & 0xf) - carry < 0:
+		f |= FLAG_H
+	if result < 0:
+		f |= FLAG_C
+	return (f << 8) | (result & 0xff)
+
+
+def _logic(result, f):
+	if result == 0:
+		f |= FLAG_Z
+	return (f << 8) | result
+
+
+def _inc(value):
+	result = (value + 1) & 0xff
+	f = 0
+	if result == 0:
+		f |= FLAG_Z
+	if value & 0xf == 0xf:
+		f |= FLAG_H
+	return (f << 8) | result
+
+
+def _dec(value):
+	result = (value - 1) & 0xff
+	f = FLAG_N
+	if result == 0:
+		f |= FLAG_Z
+	if value & 0xf == 0:
+		f |= FLAG_H
+	return (f << 8) | result
+
+
+ADD = array('H', [_add(a, b, c) for c in (0, 1) for a in range(256) for b in range(256)])
+SUB = array('H', [_sub(a, b, c) for c in (0, 1) for a in range(256) for b in range(256)])
+AND = array('H', [_logic(a & b, FLAG_H) for a in range(256) for b in range(256)])
+XOR = array('H', [_logic(a ^ b, 0) for a in range(256) for b in range(256)])
+OR = array('H', [_logic(a | b, 0) for a in range(256) for b in range(256)])
+INC = array('H', [_inc(v) for v in range(256)])
+DEC = array('H', [_dec(v) for v in range(256)])
+
+
+# DAA is indexed by ((F >> 4) << 8) | A.
+def _daa(f, a):
+	carry = f & FLAG_C
+	if f & FLAG_N:
+		if carry:
+			a -= 0x60
+		if f & FLAG_H:
+			a -= 0x06
+	else:
+		if carry or a > 0x99:
+			a += 0x60
+			carry = FLAG_C
+		if f & FLAG_H or (a & 0xf) > 0x9:
+			a += 0x06
+	a &= 0xff
+	f = (f & FLAG_N) | carry
+	if a == 0:
+		f |= FLAG_Z
+	return (f << 8) | a
+
+
+DAA = array('H', [_daa(f << 4, a) for f in range(16) for a in range(256)])
+
+
+# Rotates and shifts are indexed by (carry << 8) | value; only RL and RR
+# actually look at the incoming carry.
+def _shift(result, carry_out):
+	f = FLAG_C if carry_out else 0
+	if result == 0:
+		f |= FLAG_Z
+	return (f << 8) | result
+
+
+RLC = array('H', [_shift(((v << 1) | (v >> 7)) & 0xff, v >> 7) for c in (0, 1) for v in range(256)])
+RRC = array('H', [_shift((v >> 1) | ((v & 1) << 7), v & 1) for c in (0, 1) for v in range(256)])
+RL = array('H', [_shift(((v << 1) | c) & 0xff, v >> 7) for c in (0, 1) for v in range(256)])
+RR = array('H', [_shift((v >> 1) | (c << 7), v & 1) for c in (0, 1) for v in range(256)])
+SLA = array('H', [_shift((v << 1) & 0xff, v >> 7) for c in (0, 1) for v in range(256)])
+SRA = array('H', [_shift((v >> 1) | (v & 0x80), v & 1) for c in (0, 1) for v in range(256)])
+SWAP = array('H', [_shift(((v << 4) | (v >> 4)) & 0xff, 0) for c in (0, 1) for v in range(256)])
+SRL = array('H', [_shift(v >> 1, v & 1) for c in (0, 1) for v in range(256)])
@@ -0,0 +1,82 @@
+import mmap
+
+BANK_SIZE = 0x4000
+
+# Cartridge type byte (0x147): (memory bank controller, has RAM, has battery,
+# has a real time clock)
+_TYPES = {
+	0x00: (None, False, False, False),
+	0x01: ('MBC1', False, False, False),
+	0x02: ('MBC1', True, False, False),
+	0x03: ('MBC1', True, True, False),
+	0x05: ('MBC2', True, False, False),
+	0x06: ('MBC2', True, True, False),
+	0x08: (None, True, False, False),
+	0x09: (None, True, True, False),
+	0x0f: ('MBC3', False, True, True),
+	0x10: ('MBC3', True, True, True),
+	0x11: ('MBC3', False, False, False),
+	0x12: ('MBC3', True, False, False),
+	0x13: ('MBC3', True, True, False),
+	0x19: ('MBC5', False, False, False),
+	0x1a: ('MBC5', True, False, False),
+	0x1b: ('MBC5', True, True, False),
+	0x1c: ('MBC5', False, False, False),
+	0x1d: ('MBC5', True, False, False),
+	0x1e: ('MBC5', True, True, False),
+}
+
+# External RAM size byte (0x149) in bytes. MBC2 has 512 half-bytes built in
+# and reports 0 here.
+_RAM_SIZES = {0: 0, 1: 0x800, 2: 0x2000, 3: 0x8000, 4: 0x20000, 5: 0x10000}
+
+
+class UnsupportedCartridgeException(Exception):
+	pass
+
+
+# A cartridge ROM, mapped straight from the file rather than read into memory,
+# so loading is instant whatever the size and every emulator running the same
+# ROM shares the same page cache pages. Banks are zero-copy memoryview slices
+# of the mapping.
+class Cartridge():
+	def __init__(self, romFile):
+		size = romFile.seek(0, 2)
+		romFile.seek(0)
+		if size >= 2 * BANK_SIZE and size % BANK_SIZE == 0:
+			self._data = mmap.mmap(romFile.fileno(), 0, access=mmap.ACCESS_READ)
+		else:
+			# Homebrew and test ROMs can be shorter than the 32 KB minimum,
+			# which a mapping can't be padded out to
+			self._data = bytearray(romFile.read()).ljust(2 * BANK_SIZE, b'\xff')
+			size = len(self._data)
+		view = memoryview(self._data)
+		self.banks = [view[addr:addr + BANK_SIZE] for addr in range(0, size, BANK_SIZE)]
+
+		header = self.banks[0]
+		self.title = bytes(header[0x134:0x144]).split(b'\0')[0].decode('ascii', 'replace')
+		self.type = header[0x147]
+		if self.type not in _TYPES:
+			raise UnsupportedCartridgeException('Cartridge type ' + hex(self.type))
+		self.mbc, self.has_ram, self.battery, self.rtc = _TYPES[self.type]
+		self.rom_size = BANK_SIZE * 2 << header[0x148]
+		self.ram_size = _RAM_SIZES.get(header[0x149], 0) if self.has_ram else 0
+		self.header_checksum = header[0x14d]
+		self.global_checksum = (header[0x14e] << 8) | header[0x14f]
+
+
+	# The boot ROM refuses to start a cartridge whose header doesn't add up
+	def header_ok(self):
+		checksum = 0
+		for value in self.banks[0][0x134:0x14d]:
+			checksum = (checksum - value - 1) & 0xff
+		return checksum == self.header_checksum
+
+
+	# Nothing checks this one, but it says whether the dump is good
+	def global_ok(self):
+		total = 0
+		for bank in self.banks:
+			total += sum(bank)
+		total -= self.banks[0][0x14e] + self.banks[0][0x14f]
+		return total & 0xffff == self.global_checksum
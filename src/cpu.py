@@ -1,1438 +1,373 @@
-import struct
-
-
-class UnimplementedInstructionException(Exception):
-	pass
+from registers import Registers
+from opcodes import build_handlers, UnimplementedInstructionException
+from recompiler import Recompiler
+from idleloop import loop_period
+from profiler import BRANCHES, BRANCH_CALL, BRANCH_RST, BRANCH_RET, RAM_BANK
+from scheduler import EVENT_INTERRUPT, EVENT_SLICE, NEVER
+from mmu import INT_JOYPAD
 
 
 class CPU():
-	def __init__(self, mmu, display):
+	# `tracer` is an optional tracer from tracing.py and `profiler` an
+	# optional profiler.Profiler; either one runs the interpreter, a step at
+	# a time, in a loop of its own. `lazy_flags` only affects recompiled code.
+	def __init__(self, mmu, scheduler, recompile=False, tracer=None, profiler=None, lazy_flags=False):
 		self._mmu = mmu
-		self._display = display
-		self._cycles = 0
+		self._scheduler = scheduler
 		self._interrupts_enabled = True
-		self._registers = {
-			'A': 0x01,
-			'F': 0xb0,
-			'B': 0,
-			'C': 0x13,
-			'D': 0,
-			'E': 0xd8,
-			'H': 0x01,
-			'L': 0x4d,
-			'SP': 0xfffe,
-			'PC': 0x100
-		}
-		self._instructions = [
-			self._ins_0x0,
-			self._ins_0x1,
-			self._ins_0x2,
-			self._ins_0x3,
-			self._ins_0x4,
-			self._ins_0x5,
-			self._ins_0x6,
-			self._ins_0x7,
-			self._ins_0x8,
-			self._ins_0x9,
-			self._ins_0xa,
-			self._ins_0xb,
-			self._ins_0xc,
-			self._ins_0xd,
-			self._ins_0xe,
-			self._ins_0xf,
-			self._ins_0x10,
-			self._ins_0x11,
-			self._ins_0x12,
-			self._ins_0x13,
-			self._ins_0x14,
-			self._ins_0x15,
-			self._ins_0x16,
-			self._ins_0x17,
-			self._ins_0x18,
-			self._ins_0x19,
-			self._ins_0x1a,
-			self._ins_0x1b,
-			self._ins_0x1c,
-			self._ins_0x1d,
-			self._ins_0x1e,
-			self._ins_0x1f,
-			self._ins_0x20,
-			self._ins_0x21,
-			self._ins_0x22,
-			self._ins_0x23,
-			self._ins_0x24,
-			self._ins_0x25,
-			self._ins_0x26,
-			self._ins_0x27,
-			self._ins_0x28,
-			self._ins_0x29,
-			self._ins_0x2a,
-			self._ins_0x2b,
-			self._ins_0x2c,
-			self._ins_0x2d,
-			self._ins_0x2e,
-			self._ins_0x2f,
-			self._ins_0x30,
-			self._ins_0x31,
-			self._ins_0x32,
-			self._ins_0x33,
-			self._ins_0x34,
-			self._ins_0x35,
-			self._ins_0x36,
-			self._ins_0x37,
-			self._ins_0x38,
-			self._ins_0x39,
-			self._ins_0x3a,
-			self._ins_0x3b,
-			self._ins_0x3c,
-			self._ins_0x3d,
-			self._ins_0x3e,
-			self._ins_0x3f,
-			self._ins_0x40,
-			self._ins_0x41,
-			self._ins_0x42,
-			self._ins_0x43,
-			self._ins_0x44,
-			self._ins_0x45,
-			self._ins_0x46,
-			self._ins_0x47,
-			self._ins_0x48,
-			self._ins_0x49,
-			self._ins_0x4a,
-			self._ins_0x4b,
-			self._ins_0x4c,
-			self._ins_0x4d,
-			self._ins_0x4e,
-			self._ins_0x4f,
-			self._ins_0x50,
-			self._ins_0x51,
-			self._ins_0x52,
-			self._ins_0x53,
-			self._ins_0x54,
-			self._ins_0x55,
-			self._ins_0x56,
-			self._ins_0x57,
-			self._ins_0x58,
-			self._ins_0x59,
-			self._ins_0x5a,
-			self._ins_0x5b,
-			self._ins_0x5c,
-			self._ins_0x5d,
-			self._ins_0x5e,
-			self._ins_0x5f,
-			self._ins_0x60,
-			self._ins_0x61,
-			self._ins_0x62,
-			self._ins_0x63,
-			self._ins_0x64,
-			self._ins_0x65,
-			self._ins_0x66,
-			self._ins_0x67,
-			self._ins_0x68,
-			self._ins_0x69,
-			self._ins_0x6a,
-			self._ins_0x6b,
-			self._ins_0x6c,
-			self._ins_0x6d,
-			self._ins_0x6e,
-			self._ins_0x6f,
-			self._ins_0x70,
-			self._ins_0x71,
-			self._ins_0x72,
-			self._ins_0x73,
-			self._ins_0x74,
-			self._ins_0x75,
-			self._ins_0x76,
-			self._ins_0x77,
-			self._ins_0x78,
-			self._ins_0x79,
-			self._ins_0x7a,
-			self._ins_0x7b,
-			self._ins_0x7c,
-			self._ins_0x7d,
-			self._ins_0x7e,
-			self._ins_0x7f,
-			self._ins_0x80,
-			self._ins_0x81,
-			self._ins_0x82,
-			self._ins_0x83,
-			self._ins_0x84,
-			self._ins_0x85,
-			self._ins_0x86,
-			self._ins_0x87,
-			self._ins_0x88,
-			self._ins_0x89,
-			self._ins_0x8a,
-			self._ins_0x8b,
-			self._ins_0x8c,
-			self._ins_0x8d,
-			self._ins_0x8e,
-			self._ins_0x8f,
-			self._ins_0x90,
-			self._ins_0x91,
-			self._ins_0x92,
-			self._ins_0x93,
-			self._ins_0x94,
-			self._ins_0x95,
-			self._ins_0x96,
-			self._ins_0x97,
-			self._ins_0x98,
-			self._ins_0x99,
-			self._ins_0x9a,
-			self._ins_0x9b,
-			self._ins_0x9c,
-			self._ins_0x9d,
-			self._ins_0x9e,
-			self._ins_0x9f,
-			self._ins_0xa0,
-			self._ins_0xa1,
-			self._ins_0xa2,
-			self._ins_0xa3,
-			self._ins_0xa4,
-			self._ins_0xa5,
-			self._ins_0xa6,
-			self._ins_0xa7,
-			self._ins_0xa8,
-			self._ins_0xa9,
-			self._ins_0xaa,
-			self._ins_0xab,
-			self._ins_0xac,
-			self._ins_0xad,
-			self._ins_0xae,
-			self._ins_0xaf,
-			self._ins_0xb0,
-			self._ins_0xb1,
-			self._ins_0xb2,
-			self._ins_0xb3,
-			self._ins_0xb4,
-			self._ins_0xb5,
-			self._ins_0xb6,
-			self._ins_0xb7,
-			self._ins_0xb8,
-			self._ins_0xb9,
-			self._ins_0xba,
-			self._ins_0xbb,
-			self._ins_0xbc,
-			self._ins_0xbd,
-			self._ins_0xbe,
-			self._ins_0xbf,
-			self._ins_0xc0,
-			self._ins_0xc1,
-			self._ins_0xc2,
-			self._ins_0xc3,
-			self._ins_0xc4,
-			self._ins_0xc5,
-			self._ins_0xc6,
-			self._ins_0xc7,
-			self._ins_0xc8,
-			self._ins_0xc9,
-			self._ins_0xca,
-			self._ins_0xcb,
-			self._ins_0xcc,
-			self._ins_0xcd,
-			self._ins_0xce,
-			self._ins_0xcf,
-			self._ins_0xd0,
-			self._ins_0xd1,
-			self._ins_0xd2,
-			self._ins_0xd3,
-			self._ins_0xd4,
-			self._ins_0xd5,
-			self._ins_0xd6,
-			self._ins_0xd7,
-			self._ins_0xd8,
-			self._ins_0xd9,
-			self._ins_0xda,
-			self._ins_0xdb,
-			self._ins_0xdc,
-			self._ins_0xdd,
-			self._ins_0xde,
-			self._ins_0xdf,
-			self._ins_0xe0,
-			self._ins_0xe1,
-			self._ins_0xe2,
-			self._ins_0xe3,
-			self._ins_0xe4,
-			self._ins_0xe5,
-			self._ins_0xe6,
-			self._ins_0xe7,
-			self._ins_0xe8,
-			self._ins_0xe9,
-			self._ins_0xea,
-			self._ins_0xeb,
-			self._ins_0xec,
-			self._ins_0xed,
-			self._ins_0xee,
-			self._ins_0xef,
-			self._ins_0xf0,
-			self._ins_0xf1,
-			self._ins_0xf2,
-			self._ins_0xf3,
-			self._ins_0xf4,
-			self._ins_0xf5,
-			self._ins_0xf6,
-			self._ins_0xf7,
-			self._ins_0xf8,
-			self._ins_0xf9,
-			self._ins_0xfa,
-			self._ins_0xfb,
-			self._ins_0xfc,
-			self._ins_0xfd,
-			self._ins_0xfe,
-			self._ins_0xff
-		]
-
-	###	
-	# Register access functions
-	###
-
-	def _pc(self):
-		return self._registers['PC']
-
-
-	def _pc_set(self, addr):
-		self._registers['PC'] = addr
-
-	
-	def _pc_inc(self):
-		self._pc_set(self._pc() + 1)
-
-
-	def _bc(self):
-		return (self._registers['B'] << 4) + self._registers['C']
-
-
-	def _bc_set(self, value):
-		self._registers['B'] = value >> 4
-		self._registers['C'] = value & 0xffff
-
-
-	def _de(self):
-		return (self._registers['D'] << 4) + self._registers['E']
-
-
-	def _de_set(self, value):
-		self._registers['D'] = value >> 4
-		self._registers['E'] = value & 0xffff
-
-
-	def _hl(self):
-		return (self._registers['H'] << 4) + self._registers['L']
-
-
-	def _hl_set(self, value):
-		self._registers['H'] = value >> 4
-		self._registers['L'] = value & 0xffff
-
-
-	def _flag(self, flag):
-		value = self._registers['F']
-		if flag == 'Z':
-			return (value & 128) != 0
-		elif flag == 'N':
-			return (value & 64) != 0
-		elif flag == 'H':
-			return (value & 32) != 0
-		elif flag == 'C':
-			return (value & 32) != 0
-
-	
-	def _flag_set(self, flag, set_1):
-		if set_1:
-			if flag == 'Z':
-				self._registers['F'] = self._registers['F'] | 128
-			elif flag == 'N':
-				self._registers['F'] = self._registers['F'] | 64
-			elif flag == 'H':
-				self._registers['F'] = self._registers['F'] | 32
-			elif flag == 'C':
-				self._registers['F'] = self._registers['F'] | 16
-		else:
-			if flag == 'Z':
-				self._registers['F'] = self._registers['F'] & 127
-			elif flag == 'N':
-				self._registers['F'] = self._registers['F'] & 191
-			elif flag == 'H':
-				self._registers['F'] = self._registers['F'] & 223
-			elif flag == 'C':
-				self._registers['F'] = self._registers['F'] & 239
-
-
-	def _pop_ins_8(self):
-		result = self._mmu.read8(self._pc())
-		self._pc_inc()
-		return result
-
-
-	def _pop_ins_8_signed(self):
-		result = self._mmu.read8_signed(self._pc())
-		self._pc_inc()
-		return result
-
-
-	def _pop_ins_16(self):
-		result = self._mmu.read16(self._pc())
-		self._pc_inc()
-		self._pc_inc()
-		return result
-
-
+		# While halted, the interrupt request bits that wake the CPU up
+		self._halted = False
+		self._wake_mask = 0x1f
+		self._registers = Registers()
+		# Iteration cycles of every backward JR checked for an idle loop,
+		# by (ROM bank, address), with 0 for the ones that aren't. JRs
+		# outside the banked ROM area that aren't are also flagged here so
+		# the handlers don't even ask.
+		self._loops = {}
+		self._loop_pages = {}
+		self.busy_loops = bytearray(0x10000)
+		self._instructions, self._cb_instructions = build_handlers(self, self._registers, self._mmu)
+		self._recompiler = Recompiler(self, self._registers, self._mmu, lazy_flags) if recompile and not (tracer or profiler) else None
+		self._tracer = tracer
+		self._profiler = profiler
+		self.instruction_count = 0
+		scheduler.register(EVENT_INTERRUPT, self._service_interrupts)
+		scheduler.register(EVENT_SLICE, self._slice_end)
+		mmu.io_handler(0x0f, self._reg_if_set)
+		mmu.io_handler(0xff, self._reg_ie_set)
+
+
+	# Runs one instruction, or one translated block when recompiling, plus
+	# any events that became due, and returns the number of instructions
+	# executed
 	def tick(self):
-		addr = self._pc()
-		instruction = self._pop_ins_8()
-		print('Executing ' + hex(instruction) + ' @ ' + hex(addr))
+		if self._halted:
+			self._idle()
+			self._scheduler.run_due()
+			return 0
+		addr = self._registers.pc
+		block = self._recompiler.block(addr) if self._recompiler else None
+		if block:
+			function, count = block
+			self._scheduler.now += function()
+		else:
+			instruction = self._mmu.read8(addr)
+			if self._tracer:
+				self._tracer.record(addr, instruction, self._registers)
+			count = 1
+			try:
+				self._scheduler.now += self._instructions[instruction]()
+			except UnimplementedInstructionException:
+				self._crashed()
+				print('Unimplemented instruction ' + hex(instruction) + ' @ ' + hex(addr))
+				exit()
+			except Exception:
+				self._crashed()
+				raise
+		self._scheduler.run_due()
+		return count
+
+
+	# Runs until at least `cycles` cycles have passed, handling every event
+	# that falls due on the way, and returns how many actually did (the last
+	# instruction or block can overshoot).
+	def run_for(self, cycles):
+		scheduler = self._scheduler
+		start = scheduler.now
+		end = start + cycles
+		scheduler.schedule(EVENT_SLICE, end)
+		while scheduler.now < end:
+			self.run_until_event()
+			scheduler.run_due()
+		return scheduler.now - start
+
+
+	# Runs straight up to the next scheduled event without handling it, and
+	# returns the number of cycles that took
+	def run_until_event(self):
+		if self._halted:
+			return self._idle()
+		if self._tracer:
+			return self._run_until_event_traced()
+		if self._profiler:
+			return self._run_until_event_profiled()
+		if self._recompiler:
+			return self._run_until_event_recompiled()
+		instructions = self._instructions
+		read8 = self._mmu.read8
+		regs = self._registers
+		scheduler = self._scheduler
+		start = scheduler.now
+		count = 0
 		try:
-			self._instructions[instruction]()
-			if self._cycles > 70150:
-				self._display.draw()
-				self._cycles = 0
+			while scheduler.now < scheduler.deadline:
+				scheduler.now += instructions[read8(regs.pc)]()
+				count += 1
 		except UnimplementedInstructionException:
-			print('Unimplemented instruction ' + hex(instruction))
+			print('Unimplemented instruction ' + hex(read8(regs.pc)) + ' @ ' + hex(regs.pc))
 			exit()
+		finally:
+			self.instruction_count += count
+		return scheduler.now - start
+
+
+	def _run_until_event_recompiled(self):
+		instructions = self._instructions
+		block_at = self._recompiler.block
+		read8 = self._mmu.read8
+		regs = self._registers
+		scheduler = self._scheduler
+		start = scheduler.now
+		count = 0
+		try:
+			while scheduler.now < scheduler.deadline:
+				block = block_at(regs.pc)
+				if block:
+					function, length = block
+					scheduler.now += function()
+					count += length
+				else:
+					scheduler.now += instructions[read8(regs.pc)]()
+					count += 1
+		except UnimplementedInstructionException:
+			print('Unimplemented instruction ' + hex(read8(regs.pc)) + ' @ ' + hex(regs.pc))
+			exit()
+		finally:
+			self.instruction_count += count
+		return scheduler.now - start
+
+
+	# Same as run_until_event, handing every instruction to the tracer first
+	def _run_until_event_traced(self):
+		instructions = self._instructions
+		record = self._tracer.record
+		read8 = self._mmu.read8
+		regs = self._registers
+		scheduler = self._scheduler
+		start = scheduler.now
+		count = 0
+		try:
+			while scheduler.now < scheduler.deadline:
+				pc = regs.pc
+				instruction = read8(pc)
+				record(pc, instruction, regs)
+				scheduler.now += instructions[instruction]()
+				count += 1
+		except UnimplementedInstructionException:
+			self._crashed()
+			print('Unimplemented instruction ' + hex(read8(regs.pc)) + ' @ ' + hex(regs.pc))
+			exit()
+		except Exception:
+			self._crashed()
+			raise
+		finally:
+			self.instruction_count += count
+		return scheduler.now - start
+
+
+	# Same as run_until_event, counting every instruction into the profiler
+	def _run_until_event_profiled(self):
+		profiler = self._profiler
+		opcode_counts = profiler.opcode_counts
+		opcode_cycles = profiler.opcode_cycles
+		pc_counts = profiler.pc_counts
+		pc_cycles = profiler.pc_cycles
+		bank_counts = profiler.bank_counts
+		bank_cycles = profiler.bank_cycles
+		instructions = self._instructions
+		mmu = self._mmu
+		read8 = mmu.read8
+		regs = self._registers
+		scheduler = self._scheduler
+		start = scheduler.now
+		count = 0
+		# An interrupt was dispatched since the last slice
+		if profiler.expected_pc is not None and regs.pc != profiler.expected_pc:
+			profiler.call(regs.pc, regs.sp)
+		spent = 0
+		try:
+			while scheduler.now < scheduler.deadline:
+				pc = regs.pc
+				instruction = read8(pc)
+				code = instruction if instruction != 0xcb else 0x100 | read8((pc + 1) & 0xffff)
+				cycles = instructions[instruction]()
+				scheduler.now += cycles
+				count += 1
+				spent += cycles
+				opcode_counts[code] += 1
+				opcode_cycles[code] += cycles
+				pc_counts[pc] += 1
+				pc_cycles[pc] += cycles
+				bank = mmu.rom_bank0 if pc < 0x4000 else mmu.rom_bank if pc < 0x8000 else RAM_BANK
+				bank_counts[bank] += 1
+				bank_cycles[bank] += cycles
+				branch = BRANCHES[instruction]
+				if branch:
+					if branch == BRANCH_RST or (branch == BRANCH_CALL and regs.pc != (pc + 3) & 0xffff):
+						profiler.add_stack_cycles(spent)
+						spent = 0
+						profiler.call(regs.pc, regs.sp)
+					elif branch == BRANCH_RET and regs.pc != (pc + 1) & 0xffff:
+						profiler.add_stack_cycles(spent)
+						spent = 0
+						profiler.ret(regs.sp)
+		except UnimplementedInstructionException:
+			print('Unimplemented instruction ' + hex(read8(regs.pc)) + ' @ ' + hex(regs.pc))
+			exit()
+		finally:
+			profiler.add_stack_cycles(spent)
+			profiler.expected_pc = regs.pc
+			self.instruction_count += count
+		return scheduler.now - start
 
 
-	###
-	# Meta instructions called by others
-	###
-
-	def _meta_push(self, value):
-		self._registers['SP'] -= 1
-		self._mmu.write8(self._registers['SP'], value)
-
-
-	def _meta_pop(self):
-		value = self._mmu.read8(self._registers['SP'])
-		self._registers['SP'] += 1
-		return valueS
-
-
-	def _meta_rst(self, offset):
-		self._cycles += 32
-		part1 = self._registers['SP'] >> 8
-		part2 = self._registers['SP'] & 0xff
-		self._meta_push(part1)
-		self._meta_push(part2)
-		self._registers['PC'] = offset
-
-
-	def _meta_dec(self, register):
-		if self._registers[register] == 0:
-			self._registers[register] = 0xff
-		else:
-			self._registers[register] -= 1
-		self._flag_set('Z', self._registers[register] == 0)
-		self._flag_set('N', True)
-
-
-	def _meta_dec16(self, getter, setter):
-		if getter() == 0:
-			setter(0xffff)
-		else:
-			setter(getter() - 1)
-		self._flag_set('Z', getter() == 0)
-		self._flag_set('N', True)
-
-
-	def _meta_inc(self, register):
-		if self._registers[register] == 0xff:
-			self._registers[register] = 0
-		else:
-			self._registers[register] += 1
-		self._flag_set('Z', self._registers[register] == 0)
-		self._flag_set('N', True)
-
-
-	def _meta_call(self, addr):
-		part1 = self._registers['SP'] >> 8
-		part2 = self._registers['SP'] & 0xff
-		self._meta_push(part1)
-		self._meta_push(part2)
-		self._registers['PC'] = addr
-
+	def _crashed(self):
+		if self._tracer:
+			self._tracer.crash()
 
-	def _meta_ld_r_r(self, dst, src):
-		self._registers[dst] = self._registers[src]
 
+	def _slice_end(self, when):
+		pass
 
-	def _meta_or(self, dst, src):
-		self._registers[dst] = self._registers[dst] | self._registers[src]
-		# print(self._registers[dst])
-		self._flag_set('Z', self._registers[dst] == 0)
-		self._flag_set('N', False)
-		self._flag_set('H', False)
-		self._flag_set('C', False)
 
 	###
-	# Instruction handlers
+	# HALT and STOP
+	#
+	# Nothing but an interrupt request can end a HALT, and interrupts are
+	# only ever requested from scheduled events or register writes, so a
+	# halted CPU skips straight to the next event rather than stepping.
 	###
 
-	def _ins_0x0(self):
-		self._cycles += 4
-		pass
-
-
-	# LD BC, d16
-	def _ins_0x1(self):
-		self._cycles += 12
-		self._bc_set(self._pop_ins_16())
-
-
-	def _ins_0x2(self):
-		raise UnimplementedInstructionException
-
-
-	# INC BC
-	def _ins_0x3(self):
-		self._cycles += 8
-		self._bc_set(self._bc() + 1)
-
-
-	def _ins_0x4(self):
-		raise UnimplementedInstructionException
-
-
-	# DEC B
-	def _ins_0x5(self):
-		self._cycles += 4
-		self._meta_dec('B')
-		
-
-	# LD B, d8
-	def _ins_0x6(self):
-		self._cycles += 8
-		self._registers['B'] = self._pop_ins_8()
-
-	def _ins_0x7(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x8(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x9(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xa(self):
-		raise UnimplementedInstructionException
-
-
-	# DEC BC
-	def _ins_0xb(self):
-		self._cycles += 8
-		self._meta_dec16(self._bc, self._bc_set)
-
-
-	# INC C
-	def _ins_0xc(self):
-		self._cycles += 4
-		self._meta_inc('C')
-
-
-	# DEC C
-	def _ins_0xd(self):
-		self._cycles += 4
-		self._meta_dec('C')
-		print('C', self._registers['C'])
-
-
-	# LD C, d8
-	def _ins_0xe(self):
-		self._cycles += 8
-		self._registers['C'] = self._pop_ins_8()
-
-
-	# RRCA
-	def _ins_0xf(self):
-		dropped_bit = ((self._registers['A'] << 7) & 0xff) >> 7
-		self._registers['A'] == self._registers['A'] >> 1
-		self._flag_set('Z', self._registers['A'] == 0)
-		self._flag_set('N', False)
-		self._flag_set('H', False)
-		self._flag_set('C', dropped_bit == 1)
-
-
-	# STOP 0
-	def _ins_0x10(self):
-		raise UnimplementedInstructionException
-
-
-	# LD DE, d16
-	def _ins_0x11(self):
-		self._cycles += 12
-		self._DE_set(self._pop_ins_16())
-
-
-	def _ins_0x12(self):
-		raise UnimplementedInstructionException
-
-
-	# INC DE
-	def _ins_0x13(self):
-		self._cycles += 8
-		self._de_set(self._de() + 1)
-
-
-	# INC D
-	def _ins_0x14(self):
-		self._cycles += 4
-		self._registers['D'] += 1
-		self._flag_set('Z', self._registers['D'] == 0)
-		self._flag_set('N', False)
-
-
-	# DEC D
-	def _ins_0x15(self):
-		self._cycles += 4
-		self._registers['D'] -= 1
-		self._flag_set('Z', self._registers['D'] == 0)
-		self._flag_set('N', True)
-
-
-	def _ins_0x16(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x17(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x18(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x19(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x1a(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x1b(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x1c(self):
-		raise UnimplementedInstructionException
-
-
-	# DEC E
-	def _ins_0x1d(self):
-		self._cycles += 4
-		self._registers['E'] -= 1
-		self._flag_set('Z', self._registers['E'] == 0)
-		self._flag_set('N', True)
-
-
-	# LD E, d8
-	def _ins_0x1e(self):
-		self._cycles += 8
-		self._registers['E'] = self._pop_ins_8()
-
-
-	# RRA
-	# I don't understand how this is different from RRCA...
-	def _ins_0x1f(self):
-		dropped_bit = ((self._registers['A'] << 7) & 0xff) >> 7
-		self._registers['A'] == self._registers['A'] >> 1
-		self._flag_set('Z', self._registers['A'] == 0)
-		self._flag_set('N', False)
-		self._flag_set('H', False)
-		self._flag_set('C', dropped_bit == 1)
-
-
-	# JR NZ, r8
-	def _ins_0x20(self):
-		self._cycles += 8 # Some docs say it could also be 12? Hmm
-		addr = self._pc() + self._pop_ins_8_signed() + 1
-		if not self._flag('Z'):
-			self._pc_set(addr)
-
-
-	# LD HL, d16
-	def _ins_0x21(self):
-		self._cycles += 12
-		self._hl_set(self._pop_ins_16())
-
-
-	def _ins_0x22(self):
-		raise UnimplementedInstructionException
-
-
-	# INC HL
-	def _ins_0x23(self):
-		self._cycles += 8
-		self._hl_set(self._hl() + 1)
-
-
-	def _ins_0x24(self):
-		raise UnimplementedInstructionException
-
-
-	# DEC H
-	def _ins_0x25(self):
-		self._cycles += 4
-		self._registers['H'] -= 1
-		self._flag_set('Z', self._registers['H'] == 0)
-		self._flag_set('N', True)
-
-
-	def _ins_0x26(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x27(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x28(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x29(self):
-		raise UnimplementedInstructionException
-
-
-	# LD A, (HL+)
-	def _ins_0x2a(self):
-		self._cycles += 8
-		addr = self._hl()
-		self._registers['A'] = self._mmu.read8(addr)
-		self._hl_set(self._hl() + 1)
-
-
-	def _ins_0x2b(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x2c(self):
-		raise UnimplementedInstructionException
-
-
-	# DEC L
-	def _ins_0x2d(self):
-		self._cycles += 4
-		self._registers['L'] -= 1
-		self._flag_set('Z', self._registers['L'] == 0)
-		self._flag_set('N', True)
-
-
-	# LD L, d8
-	def _ins_0x2e(self):
-		self._cycles += 8
-		self._registers['L'] = self._pop_ins_8()
-
-
-	def _ins_0x2f(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x30(self):
-		raise UnimplementedInstructionException
-
-
-	# LD SP, d16
-	def _ins_0x31(self):
-		self._cycles += 12
-		self._registers['SP'] = self._pop_ins_16()
-
-
-	# LD (HL-), A (and some other mnemonics for some reason?)
-	def _ins_0x32(self):
-		self._cycles += 8
-		addr = self._hl()
-		value = self._registers['A']
-		self._mmu.write8(addr, value)
-
-
-	# INC SP
-	def _ins_0x33(self):
-		self._cycles += 8
-		self._sp_set(self._sp() + 1)
-
-
-	def _ins_0x34(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x35(self):
-		raise UnimplementedInstructionException
-
-
-	# LD (HL), d8
-	def _ins_0x36(self):
-		self._cycles += 12
-		self._mmu.write8(self._hl(), self._pop_ins_8())
-
-
-	def _ins_0x37(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x38(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x39(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x3a(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x3b(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x3c(self):
-		raise UnimplementedInstructionException
-
-
-	# DEC A
-	def _ins_0x3d(self):
-		self._cycles += 4
-		self._registers['A'] -= 1
-		self._flag_set('Z', self._registers['A'] == 0)
-		self._flag_set('N', True)
-
-
-	# LD A, d8
-	def _ins_0x3e(self):
-		self._cycles += 8
-		self._registers['A'] = self._pop_ins_8()
-
-
-	def _ins_0x3f(self):
-		raise UnimplementedInstructionException
-
-
-	# LD B, B
-	def _ins_0x40(self):
-		self._cycles += 4
-
-
-	def _ins_0x41(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x42(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x43(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x44(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x45(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x46(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x47(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x48(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x49(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x4a(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x4b(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x4c(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x4d(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x4e(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x4f(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x50(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x51(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x52(self):
-		raise UnimplementedInstructionException
+	# Returns the cycles HALT takes, which is everything up to the next event
+	def _halt(self):
+		mmu = self._mmu
+		if mmu.read_io(0xff) & mmu.read_io(0x0f) & 0x1f:
+			return 4
+		self._halted = True
+		self._wake_mask = 0x1f
+		scheduler = self._scheduler
+		return max(4, scheduler.deadline - scheduler.now)
 
-	def _ins_0x53(self):
-		raise UnimplementedInstructionException
 
-	def _ins_0x54(self):
-		raise UnimplementedInstructionException
+	# STOP resets DIV and waits for a button press
+	def _stop(self):
+		self._mmu.write8(0xff04, 0)
+		self._halted = True
+		self._wake_mask = INT_JOYPAD
+		scheduler = self._scheduler
+		return max(4, scheduler.deadline - scheduler.now)
 
-	def _ins_0x55(self):
-		raise UnimplementedInstructionException
 
-	def _ins_0x56(self):
-		raise UnimplementedInstructionException
+	def _idle(self):
+		scheduler = self._scheduler
+		skipped = max(0, scheduler.deadline - scheduler.now)
+		scheduler.now += skipped
+		return skipped
 
-	def _ins_0x57(self):
-		raise UnimplementedInstructionException
 
-	def _ins_0x58(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x59(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x5a(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x5b(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x5c(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x5d(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x5e(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x5f(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x60(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x61(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x62(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x63(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x64(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x65(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x66(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x67(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x68(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x69(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x6a(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x6b(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x6c(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x6d(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x6e(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x6f(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x70(self):
-		raise UnimplementedInstructionException
-
-
-	# LD (HL), C
-	def _ins_0x71(self):
-		self._cycles += 8
-		addr = self._hl()
-		value = self._registers['C']
-		self._mmu.write8(addr, value)
-		
-
-	def _ins_0x72(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x73(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x74(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x75(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x76(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x77(self):
-		raise UnimplementedInstructionException
-
-
-	# LD A, B
-	def _ins_0x78(self):
-		self._meta_ld_r_r('A', 'B')
-
-
-	def _ins_0x79(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x7a(self):
-		self._cycles += 4
-		self._registers['A'] = self._registers['D']
-
-	def _ins_0x7b(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x7c(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x7d(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x7e(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x7f(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x80(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x81(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x82(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x83(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x84(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x85(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x86(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x87(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x88(self):
-		raise UnimplementedInstructionException
-
-
-	# ADC A, C
-	def _ins_0x89(self):
-		self._cycles += 4
-		self._registers['A'] += self._registers['C']
-		self._flag_set('Z', self._registers['A'] == 0)
-		self._flag_set('N', False)
-		# TODO carry flags...
-
-
-	def _ins_0x8a(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x8b(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x8c(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x8d(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x8e(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x8f(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x90(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x91(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x92(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x93(self):
-		raise UnimplementedInstructionException
-
-
-	# SUB H
-	def _ins_0x94(self):
-		self._cycles += 4
-		self._registers['A'] -= self._registers['H']
-		self._flag_set('Z', self._registers['A'] == 0)
-		self._flag_set('N', True)
-		# TODO set other flags
-
-	def _ins_0x95(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x96(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x97(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x98(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x99(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x9a(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x9b(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x9c(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x9d(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x9e(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0x9f(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xa0(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xa1(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xa2(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xa3(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xa4(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xa5(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xa6(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xa7(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xa8(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xa9(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xaa(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xab(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xac(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xad(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xae(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xaf(self):
-		self._cycles += 4
-		self._registers['A'] = 0
-
-	def _ins_0xb0(self):
-		raise UnimplementedInstructionException
-
-
-	# OR C
-	def _ins_0xb1(self):
-		self._cycles += 4
-		self._meta_or('A', 'C')
-
-
-	def _ins_0xb2(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xb3(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xb4(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xb5(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xb6(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xb7(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xb8(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xb9(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xba(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xbb(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xbc(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xbd(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xbe(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xbf(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xc0(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xc1(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xc2(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xc3(self):
-		self._cycles += 16
-		addr = self._pop_ins_16()
-		self._pc_set(addr)
-
-	def _ins_0xc4(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xc5(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xc6(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xc7(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xc8(self):
-		raise UnimplementedInstructionException
-
-
-	def _ins_0xc9(self):
-		raise UnimplementedInstructionException
-
-
-	def _ins_0xca(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xcb(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xcc(self):
-		raise UnimplementedInstructionException
-
-
-	# CALL a16
-	def _ins_0xcd(self):
-		self._cycles += 24 # 12?
-		self._meta_call(self._pop_ins_16())
-
-
-	def _ins_0xce(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xcf(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xd0(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xd1(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xd2(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xd3(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xd4(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xd5(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xd6(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xd7(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xd8(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xd9(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xda(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xdb(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xdc(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xdd(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xde(self):
-		raise UnimplementedInstructionException
-
-
-	# RST 18H
-	def _ins_0xdf(self):
-		self._meta_rst(0x18)
-
-
-	# LDH (a8), A
-	def _ins_0xe0(self):
-		self._cycles += 12
-		addr = 0xff00 + self._pop_ins_8()
-		print(self._registers['A'])
-		self._mmu.write8(addr, self._registers['A'])
-
-
-	def _ins_0xe1(self):
-		raise UnimplementedInstructionException
-
-
-	# LD (C), A
-	def _ins_0xe2(self):
-		self._cycles += 8
-		self._mmu.write8(self._registers['C'], self._registers['A'])
-
-
-	def _ins_0xe3(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xe4(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xe5(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xe6(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xe7(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xe8(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xe9(self):
-		raise UnimplementedInstructionException
-
-
-	# LD (a16), A
-	def _ins_0xea(self):
-		self._cycles += 16
-		self._mmu.write8(self._pop_ins_16(), self._registers['A'])
-
-
-	def _ins_0xeb(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xec(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xed(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xee(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xef(self):
-		raise UnimplementedInstructionException
+	###
+	# Idle loops
+	#
+	# A loop polling LY, STAT or a flag an interrupt handler sets keeps
+	# seeing the same value until the next event, so rather than going round
+	# it a few hundred times, a whole number of iterations is skipped at once.
+	# That stops at the end of the iteration the event falls in, not at the
+	# instruction stepping would have reached: the loop sees the event up to
+	# one iteration late, and an interrupt then returns to the loop's head.
+	###
 
+	# Called by a backward JR from `origin` to `target`, after `cycles`
+	# cycles; returns the cycles to account for in total
+	def _idle_loop(self, target, origin, cycles):
+		if origin < 0x4000:
+			key = (self._mmu.rom_bank0, origin)
+		elif origin < 0x8000:
+			key = (self._mmu.rom_bank, origin)
+		else:
+			key = (0, origin)
+		period = self._loops.get(key)
+		if period is None:
+			period = self._check_loop(key, target, origin)
+		scheduler = self._scheduler
+		# With nothing scheduled (tick() outside run_for) there's nothing to
+		# skip to
+		if period and scheduler.deadline != NEVER:
+			remaining = scheduler.deadline - scheduler.now - cycles
+			if remaining > 0:
+				cycles += -(-remaining // period) * period
+		return cycles
+
+
+	def _check_loop(self, key, target, origin):
+		period = loop_period(self._mmu.read8, target, origin)
+		self._loops[key] = period
+		if not period and not 0x4000 <= origin < 0x8000:
+			self.busy_loops[origin] = 1
+		for page in range(target >> 8, ((origin + 1) >> 8) + 1):
+			self._loop_pages.setdefault(page, set()).add(key)
+			self._mmu.watch_code(page, self._loop_code_written)
+		return period
+
+
+	def _loop_code_written(self, addr):
+		for key in self._loop_pages.pop(addr >> 8, ()):
+			self._loops.pop(key, None)
+			self.busy_loops[key[1]] = 0
 
-	# LDH A, (a8)
-	def _ins_0xf0(self):
-		addr = 0xff00 + self._pop_ins_8()
-		self._registers['A'] = self._mmu.read8(addr)
 
+	###
+	# Stack, for pushes from outside the instruction handlers
+	###
 
-	def _ins_0xf1(self):
-		raise UnimplementedInstructionException
+	def push16(self, value):
+		regs = self._registers
+		regs.sp = (regs.sp - 2) & 0xffff
+		self._mmu.write16_high_first(regs.sp, value)
 
-	def _ins_0xf2(self):
-		raise UnimplementedInstructionException
 
+	###
+	# Interrupts
+	###
 
-	# DI
-	def _ins_0xf3(self):
-		self._cycles += 4
+	def _enable_interrupts(self, delay):
+		self._interrupts_enabled = True
+		self._scheduler.schedule(EVENT_INTERRUPT, self._scheduler.now + delay)
+
+
+	def _service_interrupts(self, when):
+		if not self._interrupts_enabled:
+			return
+		mmu = self._mmu
+		flags = mmu.read_io(0x0f)
+		pending = flags & mmu.read_io(0xff) & 0x1f
+		if not pending:
+			return
+		# The lowest set bit has the highest priority
+		bit = pending & -pending
+		mmu.write_io(0x0f, flags & ~bit)
 		self._interrupts_enabled = False
+		regs = self._registers
+		self.push16(regs.pc)
+		regs.pc = 0x40 + 8 * (bit.bit_length() - 1)
+		self._scheduler.now += 20
 
 
-	def _ins_0xf4(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xf5(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xf6(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xf7(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xf8(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xf9(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xfa(self):
-		raise UnimplementedInstructionException
-
-	def _ins_0xfb(self):
-		raise UnimplementedInstructionException
+	###
+	# Register access functions
+	###
 
-	def _ins_0xfc(self):
-		raise UnimplementedInstructionException
+	def _interrupts_changed(self):
+		if self._halted and self._mmu.read_io(0xff) & self._mmu.read_io(0x0f) & self._wake_mask:
+			self._halted = False
+		if self._interrupts_enabled:
+			self._scheduler.schedule(EVENT_INTERRUPT, self._scheduler.now)
 
-	def _ins_0xfd(self):
-		raise UnimplementedInstructionException
 
-	# CP d8
-	def _ins_0xfe(self):
-		self._cycles += 8
-		reg_a = self._registers['A']
-		arg = self._pop_ins_8()
-		self._flag_set('Z', reg_a == arg)
-		self._flag_set('N', True)
-		# TODO figure out what H is
-		self._flag_set('C', reg_a < arg)
+	def _reg_if_set(self, value):
+		self._mmu.write_io(0x0f, 0xe0 | value)
+		self._interrupts_changed()
 
 
-	# RST 38H
-	def _ins_0xff(self):
-		raise UnimplementedInstructionException
-		self._meta_rst(0x38)
\ No newline at end of file
+	def _reg_ie_set(self, value):
+		self._mmu.write_io(0xff, value)
+		self._interrupts_changed()
@@ -1,19 +1,184 @@
-from mmu import MMU
+from mmu import MMU, INT_VBLANK, INT_STAT
+from scheduler import EVENT_PPU
+from renderer import Renderer
+from framebuffer import FrameBuffer
+try:
+	from numpyrenderer import NumpyRenderer
+except ImportError:
+	NumpyRenderer = None
 
+# LCD modes, as reported in the low two bits of STAT
+MODE_HBLANK = 0
+MODE_VBLANK = 1
+MODE_OAM = 2
+MODE_TRANSFER = 3
+
+# Cycles spent in each mode on a visible line; a whole line is 456
+OAM_CYCLES = 80
+TRANSFER_CYCLES = 172
+HBLANK_CYCLES = 204
+LINE_CYCLES = 456
+
+# STAT interrupt enable bits for each mode
+_STAT_SOURCES = {
+	MODE_HBLANK: 0x08,
+	MODE_VBLANK: 0x10,
+	MODE_OAM: 0x20,
+}
+
+
+# STAT and LY are put together from the PPU's own state when they're read,
+# rather than stored every time the mode or line changes.
+#
+# With `renderer` set to 'numpy' the picture is drawn a frame at a time with
+# NumPy, if it's installed, rather than a line at a time in Python.
+#
+# Only every `render_every`th frame is drawn, or none with it at 0. Drawing
+# never feeds back into timing, so modes, LY, STAT and interrupts come out
+# exactly the same whether a frame is drawn or not.
 class Display():
-	def __init__(self, mmu):
+	def __init__(self, mmu, scheduler, renderer='python'):
 		self._mmu = mmu
+		self._scheduler = scheduler
+		self._mode = MODE_OAM
+		self._ly = 0
+		# STAT interrupt enables (bits 3-6) and the LY=LYC flag
+		self._stat = mmu.read_io(0x41) & 0x78
+		self._coincidence = False
+		# Called at the start of every HBlank, for HBlank DMA
+		self.on_hblank = None
+		if renderer == 'numpy' and not NumpyRenderer:
+			print('NumPy is not installed; rendering in Python')
+		self._renderer = (NumpyRenderer if renderer == 'numpy' and NumpyRenderer else Renderer)(mmu)
+		# Finished frames, one shade (0-3) per pixel, swapped in at VBlank
+		self.framebuffer = FrameBuffer()
+		self._renderer.target(self.framebuffer.back)
+		self.frame_count = 0
+		self.render_every = 1
+		self._rendering = True
+		scheduler.register(EVENT_PPU, self._step)
+		mmu.io_handler(0x40, self._reg_lcdc_set)
+		mmu.io_handler(0x41, self._reg_stat_set, self._reg_stat)
+		mmu.io_handler(0x44, self._reg_ly_written, self._reg_ly)
+		mmu.io_handler(0x45, self._reg_lyc_set)
+		if self._reg_lcdc() & 0x80:
+			self._start(scheduler.now)
 
 
 	def draw(self):
-		print('Drawing!')
-		self._reg_ly_set(0)
-		# draw image...
-		self._reg_ly_set(148)
+		if self._rendering:
+			self._renderer.finish_frame()
+			self._renderer.target(self.framebuffer.swap())
+		self.frame_count += 1
+
+
+	# Decides whether the frame that's starting gets drawn. A change to
+	# `render_every` takes effect from the next frame.
+	def _new_frame(self):
+		every = self.render_every
+		self._rendering = bool(every) and self.frame_count % every == 0
+
+
+	###
+	# Mode timing
+	###
+
+	def _start(self, when):
+		self._ly = 0
+		self._new_frame()
+		self._enter(MODE_OAM)
+		self._scheduler.schedule(EVENT_PPU, when + OAM_CYCLES)
+
+
+	def _step(self, when):
+		mode = self._mode
+		if mode == MODE_OAM:
+			self._enter(MODE_TRANSFER)
+			self._scheduler.schedule(EVENT_PPU, when + TRANSFER_CYCLES)
+		elif mode == MODE_TRANSFER:
+			if self._rendering:
+				self._renderer.render_line(self._ly)
+			self._enter(MODE_HBLANK)
+			if self.on_hblank:
+				self.on_hblank()
+			self._scheduler.schedule(EVENT_PPU, when + HBLANK_CYCLES)
+		elif mode == MODE_HBLANK:
+			self._ly += 1
+			if self._ly == 144:
+				self._enter(MODE_VBLANK)
+				self._mmu.request_interrupt(INT_VBLANK)
+				self.draw()
+				self._scheduler.schedule(EVENT_PPU, when + LINE_CYCLES)
+			else:
+				self._enter(MODE_OAM)
+				self._scheduler.schedule(EVENT_PPU, when + OAM_CYCLES)
+		else:
+			self._ly += 1
+			if self._ly == 154:
+				self._ly = 0
+				self._new_frame()
+				self._enter(MODE_OAM)
+				self._scheduler.schedule(EVENT_PPU, when + OAM_CYCLES)
+			else:
+				self._compare_lyc()
+				self._scheduler.schedule(EVENT_PPU, when + LINE_CYCLES)
+
+
+	def _enter(self, mode):
+		self._mode = mode
+		if self._stat & _STAT_SOURCES.get(mode, 0):
+			self._mmu.request_interrupt(INT_STAT)
+		self._compare_lyc()
+
+
+	# The LY=LYC interrupt fires when the flag goes on
+	def _compare_lyc(self):
+		coincidence = self._ly == self._mmu.read_io(0x45)
+		if coincidence and not self._coincidence and self._stat & 0x40:
+			self._mmu.request_interrupt(INT_STAT)
+		self._coincidence = coincidence
+
+
+	###
+	# Register access functions
+	###
+
+	def _reg_lcdc(self):
+		return self._mmu.read_io(0x40)
+
+
+	def _reg_lcdc_set(self, value):
+		was_on = self._reg_lcdc() & 0x80
+		self._mmu.write_io(0x40, value)
+		if value & 0x80 and not was_on:
+			self._start(self._scheduler.now)
+		elif was_on and not value & 0x80:
+			# Turning the LCD off parks it on line 0 in HBlank
+			self._scheduler.cancel(EVENT_PPU)
+			self._ly = 0
+			self._mode = MODE_HBLANK
+			self._compare_lyc()
+
+
+	def _reg_stat(self):
+		return 0x80 | self._stat | (0x04 if self._coincidence else 0) | self._mode
+
+
+	# Only the interrupt enable bits are writable
+	def _reg_stat_set(self, value):
+		self._stat = value & 0x78
 
 
 	def _reg_ly(self):
-		return self._mmu.read8(0xff44)
+		return self._ly
+
+
+	# LY is read-only
+	def _reg_ly_written(self, value):
+		pass
+
 
-	def _reg_ly_set(self, value):
-		return self._mmu.write8(0xff44, value)
+	def _reg_lyc_set(self, value):
+		self._mmu.write_io(0x45, value)
+		if self._reg_lcdc() & 0x80:
+			self._compare_lyc()
@@ -0,0 +1,126 @@
+from scheduler import EVENT_DMA, EVENT_HDMA
+
+# OAM DMA takes 160 machine cycles, one per byte
+OAM_DMA_CYCLES = 640
+
+# The CPU is held up 8 machine cycles per 16-byte HDMA block
+HDMA_BLOCK_CYCLES = 32
+
+
+# OAM DMA (0xff46) and CGB HDMA (0xff51-0xff55). Each transfer is done all at
+# once as slice copies between the MMU's buffers, one per source page; what
+# the bus does while it's going on is modelled through the scheduler
+# instead. OAM is locked away from the CPU until the transfer would have
+# finished, and HDMA stalls the CPU for as long as it would have taken, from
+# an event so the extra cycles land between instructions.
+class DMA():
+	def __init__(self, mmu, scheduler, display):
+		self._mmu = mmu
+		self._scheduler = scheduler
+		self._display = display
+		self._hdma_source = 0
+		self._hdma_dest = 0x8000
+		# Blocks left to copy, one per HBlank when `_hblank` is set
+		self._hdma_blocks = 0
+		self._hblank = False
+		scheduler.register(EVENT_DMA, self._oam_done)
+		scheduler.register(EVENT_HDMA, self._general_transfer)
+		mmu.io_handler(0x46, self._reg_dma_set)
+		mmu.io_handler(0x51, self._reg_hdma1_set, self._reg_write_only)
+		mmu.io_handler(0x52, self._reg_hdma2_set, self._reg_write_only)
+		mmu.io_handler(0x53, self._reg_hdma3_set, self._reg_write_only)
+		mmu.io_handler(0x54, self._reg_hdma4_set, self._reg_write_only)
+		mmu.io_handler(0x55, self._reg_hdma5_set, self._reg_hdma5)
+
+
+	def _oam_done(self, when):
+		self._mmu.lock_oam(False)
+
+
+	# Copies `blocks` blocks as few slice copies as possible: one per run of
+	# source that stays inside a page and destination that stays inside
+	# VRAM, which the destination wraps around
+	def _copy_blocks(self, blocks):
+		length = blocks << 4
+		while length:
+			source = self._hdma_source
+			dest = self._hdma_dest
+			run = min(length, 0x100 - (source & 0xff), 0xa000 - dest)
+			self._mmu.copy_to_vram(source, dest, run)
+			self._hdma_source = (source + run) & 0xfff0
+			self._hdma_dest = 0x8000 | ((dest + run) & 0x1ff0)
+			length -= run
+		self._scheduler.now += blocks * HDMA_BLOCK_CYCLES
+
+
+	def _general_transfer(self, when):
+		self._copy_blocks(self._hdma_blocks)
+		self._hdma_blocks = 0
+
+
+	# Called by the display at the start of each HBlank while an HBlank
+	# transfer is going
+	def _hblank_transfer(self):
+		self._copy_blocks(1)
+		self._hdma_blocks -= 1
+		if not self._hdma_blocks:
+			self._stop_hblank()
+
+
+	def _stop_hblank(self):
+		self._hblank = False
+		self._display.on_hblank = None
+
+
+	###
+	# Register access functions
+	###
+
+	# OAM can be copied from anywhere up to 0xdf00; higher sources read work
+	# RAM, as the echo does
+	def _reg_dma_set(self, value):
+		self._mmu.write_io(0x46, value)
+		self._mmu.copy_to_oam((value - 0x20 if value >= 0xe0 else value) << 8)
+		self._mmu.lock_oam(True)
+		self._scheduler.schedule(EVENT_DMA, self._scheduler.now + OAM_DMA_CYCLES)
+
+
+	def _reg_write_only(self):
+		return 0xff
+
+
+	def _reg_hdma1_set(self, value):
+		self._hdma_source = (value << 8) | (self._hdma_source & 0xf0)
+
+
+	def _reg_hdma2_set(self, value):
+		self._hdma_source = (self._hdma_source & 0xff00) | (value & 0xf0)
+
+
+	def _reg_hdma3_set(self, value):
+		self._hdma_dest = 0x8000 | ((value & 0x1f) << 8) | (self._hdma_dest & 0xf0)
+
+
+	def _reg_hdma4_set(self, value):
+		self._hdma_dest = (self._hdma_dest & 0xff00) | (value & 0xf0)
+
+
+	# Blocks left minus one, with bit 7 set once nothing is going on
+	def _reg_hdma5(self):
+		if self._hblank:
+			return self._hdma_blocks - 1
+		return 0xff
+
+
+	# Bit 7 picks an HBlank transfer over a general purpose one, which runs
+	# straight away. Writing it clear during an HBlank transfer stops it.
+	def _reg_hdma5_set(self, value):
+		if self._hblank and not value & 0x80:
+			self._stop_hblank()
+			return
+		self._hdma_blocks = (value & 0x7f) + 1
+		if value & 0x80:
+			self._hblank = True
+			self._display.on_hblank = self._hblank_transfer
+		else:
+			self._scheduler.schedule(EVENT_HDMA, self._scheduler.now)
@@ -0,0 +1,41 @@
+from gameboy import GameBoy, FRAME_CYCLES
+
+_REGISTERS = ('a', 'f', 'b', 'c', 'd', 'e', 'h', 'l', 'sp', 'pc')
+
+
+def _state(gameboy):
+	r = gameboy._cpu._registers
+	return tuple(getattr(r, name) for name in _REGISTERS) + (gameboy._scheduler.now,)
+
+
+# Differential check of lazy flags against eager ones. Steps `eager` and
+# `lazy`, two recompiling machines with the same ROM loaded, a block at a time
+# and returns a description of the first block after which their registers
+# or cycle counts differ, or None if they kept in step for `cycles` cycles.
+def compare(eager, lazy, cycles):
+	end = eager._scheduler.now + cycles
+	while eager._scheduler.now < end:
+		pc = eager._cpu._registers.pc
+		eager._cpu.tick()
+		lazy._cpu.tick()
+		expected = _state(eager)
+		actual = _state(lazy)
+		if expected != actual:
+			return 'Block @ ' + hex(pc) + ' left ' + ', '.join(
+				name + '=' + hex(value) + ' (expected ' + hex(wanted) + ')'
+				for name, value, wanted in zip(_REGISTERS + ('now',), actual, expected) if value != wanted)
+	return None
+
+
+# Each machine gets cartridge RAM of its own, so neither sees the other's
+# writes and the ROM's save file is left alone
+def check_rom(romFile, frames=60):
+	machines = []
+	for lazy_flags in (False, True):
+		gameboy = GameBoy(recompile=True, lazy_flags=lazy_flags)
+		romFile.seek(0)
+		gameboy.loadRom(romFile, save=False)
+		machines.append(gameboy)
+	result = compare(machines[0], machines[1], frames * FRAME_CYCLES)
+	print(result or 'Lazy flags matched eager flags for ' + str(frames) + ' frames')
+	return result is None
@@ -0,0 +1,138 @@
+import threading
+import zlib
+from renderer import WIDTH, HEIGHT
+
+# Colours of shades 0-3, white to black
+SCREEN_COLOURS = ((0xff, 0xff, 0xff), (0xaa, 0xaa, 0xaa), (0x55, 0x55, 0x55), (0x00, 0x00, 0x00))
+
+
+# Finished frames, handed from the emulator to whoever shows them without
+# copying. The renderer draws into `back`; at VBlank swap() makes that the
+# front frame and gives the renderer the old front to draw into next. A
+# consumer on another thread take()s the front frame in exchange for the one
+# it had, so three buffers go round and neither side ever writes a buffer the
+# other is reading. Swapping is a few reference assignments under a lock, so
+# the emulator never waits on the consumer; a frame the consumer hasn't taken
+# by the next swap is dropped.
+#
+# Frames come out as read-only memoryviews, HEIGHT rows of WIDTH shades. Each
+# is hashed as it's swapped in, a CRC32 of its shades, so a consumer can tell
+# a frame that's the same as the last one without comparing it.
+class FrameBuffer():
+	def __init__(self):
+		buffers = [bytearray(WIDTH * HEIGHT) for _ in range(3)]
+		self._views = {id(buffer): memoryview(buffer).toreadonly().cast('B', (HEIGHT, WIDTH)) for buffer in buffers}
+		self.back, self._front, self._taken = buffers
+		self._hashes = {id(buffer): zlib.crc32(buffer) for buffer in buffers}
+		self._fresh = False
+		self._closed = False
+		self._condition = threading.Condition()
+		self.dropped = 0
+
+
+	# The latest finished frame, for a consumer on the emulator's own thread:
+	# the front one, or once that's been taken, the one the consumer has
+	@property
+	def front(self):
+		with self._condition:
+			return self._views[id(self._front if self._fresh else self._taken)]
+
+
+	# Called at VBlank with a new frame in `back`; returns the buffer to draw
+	# the next one into
+	def swap(self):
+		frame_hash = zlib.crc32(self.back)
+		with self._condition:
+			self._hashes[id(self.back)] = frame_hash
+			if self._fresh:
+				self.dropped += 1
+			self.back, self._front = self._front, self.back
+			self._fresh = True
+			self._condition.notify()
+		return self.back
+
+
+	# Waits up to `timeout` seconds for a frame the consumer hasn't had yet.
+	# The view returned stays good until the next take(). Returns None on
+	# timeout or once closed.
+	def take(self, timeout=None):
+		with self._condition:
+			if not self._condition.wait_for(lambda: self._fresh or self._closed, timeout) or self._closed:
+				return None
+			self._front, self._taken = self._taken, self._front
+			self._fresh = False
+			return self._views[id(self._taken)]
+
+
+	# Hash of a frame from `front` or take(), while it's still good
+	def frame_hash(self, frame):
+		return self._hashes[id(frame.obj)]
+
+
+	def close(self):
+		with self._condition:
+			self._closed = True
+			self._condition.notify_all()
+
+
+# Turns frames of shades into packed RGB, or RGBA with `alpha`. Each channel
+# is a translate table from shade to that channel's value, made once, and a
+# whole frame goes through one translate per channel into a slice of the
+# output striding over that channel.
+class RGBConverter():
+	def __init__(self, colours=SCREEN_COLOURS, alpha=False):
+		if alpha:
+			colours = [colour + (0xff,) for colour in colours]
+		self._channels = len(colours[0])
+		self._tables = [bytes([colours[shade & 3][channel] for shade in range(256)])
+				for channel in range(self._channels)]
+		self._out = bytearray(WIDTH * HEIGHT * self._channels)
+		self._view = memoryview(self._out).toreadonly().cast('B', (HEIGHT, WIDTH, self._channels))
+
+
+	# Returns a view of HEIGHT rows of WIDTH pixels, good until the next call
+	def convert(self, frame):
+		shades = frame.obj
+		out = self._out
+		channels = self._channels
+		for channel, table in enumerate(self._tables):
+			out[channel::channels] = shades.translate(table)
+		return self._view
+
+
+# Runs `present(frame)` on its own thread for each frame it can keep up with,
+# for showing frames in a window or sending them to an encoder or socket.
+# With a `converter` (an RGBConverter) frames are converted on that thread
+# before being presented. With `unique` a frame the same as the last one
+# presented is skipped, before converting it.
+class Presenter():
+	def __init__(self, framebuffer, present, converter=None, unique=False):
+		self._framebuffer = framebuffer
+		self._present = present
+		self._converter = converter
+		self._unique = unique
+		self.skipped = 0
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+
+	def _run(self):
+		last = None
+		while True:
+			frame = self._framebuffer.take()
+			if frame is None:
+				return
+			if self._unique:
+				frame_hash = self._framebuffer.frame_hash(frame)
+				if frame_hash == last:
+					self.skipped += 1
+					continue
+				last = frame_hash
+			if self._converter:
+				frame = self._converter.convert(frame)
+			self._present(frame)
+
+
+	def close(self):
+		self._framebuffer.close()
+		self._thread.join()
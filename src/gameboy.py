@@ -2,30 +2,77 @@ from time import time
 from mmu import MMU
 from cpu import CPU
 from display import Display
+from timer import Timer
+from serial import Serial
+from joypad import Joypad
+from dma import DMA
+from scheduler import Scheduler
+from profiler import Profiler
+from saveram import FLUSH_INTERVAL
+from framebuffer import Presenter, RGBConverter
+
+# Cycles per frame: 154 lines of 456 cycles each
+FRAME_CYCLES = 70224
+
 
 class GameBoy():
-	def __init__(self):
-		self._mmu = MMU()
-		self._display = Display(self._mmu)
-		self._cpu = CPU(self._mmu, self._display)
+	# `renderer` is 'python', or 'numpy' to draw with NumPy if it's installed
+	def __init__(self, recompile=False, tracer=None, profile=None, lazy_flags=False, save_interval=FLUSH_INTERVAL,
+			renderer='python'):
+		# Both step the interpreter in a loop of their own, so only one can run
+		if tracer and profile:
+			raise ValueError('Tracing and profiling can\'t be used together')
+		self._scheduler = Scheduler()
+		self._mmu = MMU(save_interval)
+		self._display = Display(self._mmu, self._scheduler, renderer)
+		self._timer = Timer(self._mmu, self._scheduler)
+		self._serial = Serial(self._mmu, self._scheduler)
+		self._joypad = Joypad(self._mmu)
+		self._dma = DMA(self._mmu, self._scheduler, self._display)
+		# With `profile` set to a path prefix, the profile is written to
+		# PREFIX.txt and PREFIX.folded when the emulator stops
+		self._profile = profile
+		self._profiler = Profiler(self._mmu) if profile else None
+		self._cpu = CPU(self._mmu, self._scheduler, recompile, tracer, self._profiler, lazy_flags)
+		self._tracer = tracer
 
 
-	def loadRom(self, romFile):
-		self._mmu.loadRom(romFile)
+	def loadRom(self, romFile, save=True):
+		self._mmu.loadRom(romFile, save)
 
 
-	def run(self):
+	# Draws every `render_every`th frame, or none at 0 for running headless.
+	# With `present` given, it's called with each frame (a read-only
+	# memoryview of 144 rows of 160 pixels) on a thread of its own, and frames
+	# it can't keep up with are dropped. Pixels are shades 0-3, or with
+	# `pixel_format` 'rgb' or 'rgba' that many bytes each. With
+	# `unique_frames`, frames the same as the last one presented are skipped.
+	def run(self, render_every=1, present=None, pixel_format='shades', unique_frames=False):
 		print('Running...')
+		self._display.render_every = render_every
+		presenter = None
+		if present:
+			converter = RGBConverter(alpha=pixel_format == 'rgba') if pixel_format != 'shades' else None
+			presenter = Presenter(self._display.framebuffer, present, converter, unique_frames)
 		start_time = time()
-		instruction_count = 0
+		budget = FRAME_CYCLES
 
 		try:
 			while True:
-				self._cpu.tick()
-				instruction_count += 1
+				# Whatever the last frame overshot comes out of the next one
+				budget += FRAME_CYCLES - self._cpu.run_for(budget)
 		except KeyboardInterrupt:
 			exec_time = time() - start_time
+			instruction_count = self._cpu.instruction_count
 			print('\nExecuted ' + str(instruction_count) + ' instructions in ' + str(exec_time) + ' seconds')
 			instructions_per_second = instruction_count / exec_time
 			print('(' + str(instructions_per_second) + '/sec)')
+		finally:
+			if presenter:
+				presenter.close()
+			if self._tracer:
+				self._tracer.close()
+			if self._profiler:
+				self._profiler.save(self._profile)
+			self._mmu.close()
 		
\ No newline at end of file
@@ -0,0 +1,87 @@
+from opcodes import decode, body, registers_used, JUMPS, WAITS
+
+# Longest loop, in instructions including the branch back, that is checked
+# for being an idle loop
+MAX_LOOP_LENGTH = 8
+
+# Instructions that can't appear before the branch back: anything that
+# leaves the loop, waits, or changes interrupt handling
+_EXCLUDED = JUMPS + WAITS + ('EI', 'DI', 'ILLEGAL')
+
+# Memory operands a loop may read through, both at addresses fixed by the
+# code itself. (C) isn't one: C could point anywhere in the 0xff00 page,
+# DIV and TIMA included, whenever the loop is next reached.
+_OPERANDS = ('(a8)', '(a16)')
+
+
+# DIV and TIMA, which are worked out from the cycle count when read, so they
+# change with no event to mark it
+_CLOCKED = (0xff04, 0xff05)
+
+
+# Memory that nothing but a scheduled event can change while the CPU sits in
+# a loop that doesn't write: the I/O registers, HRAM and IE, which the PPU,
+# timer and interrupt handlers update, and work RAM, which only an interrupt
+# handler could write. Reading any of it has no side effects.
+def _quiet(addr):
+	return (addr >= 0xff00 and addr not in _CLOCKED) or 0xc000 <= addr < 0xe000
+
+
+# Busy-wait loops like
+#
+#	wait:	LDH A,(0x44)
+#		CP 0x90
+#		JR NZ,wait
+#
+# go round and round seeing exactly the same thing until the hardware state
+# they poll changes, and that only happens when a scheduled event fires. A
+# loop qualifies if it runs straight from `target` to the JR at `origin`, it
+# writes no memory, it reads nothing but quiet memory, and no register
+# carries over from one iteration to the next (everything it reads it either
+# never writes or sets earlier in the same iteration). Returns the cycles one
+# iteration takes, or 0 if the loop can't be skipped.
+def loop_period(read8, target, origin):
+	instructions = []
+	addr = target
+	while addr < origin:
+		opcode, prefixed = decode(read8, addr)
+		if opcode.mnemonic in _EXCLUDED:
+			return 0
+		instructions.append((addr, opcode, prefixed))
+		addr += opcode.length
+		if len(instructions) >= MAX_LOOP_LENGTH:
+			return 0
+	if addr != origin:
+		return 0
+	opcode, prefixed = decode(read8, origin)
+	if opcode.mnemonic != 'JR' or ((origin + 2 + ((read8(origin + 1) ^ 0x80) - 0x80)) & 0xffff) != target:
+		return 0
+	instructions.append((origin, opcode, prefixed))
+
+	bodies = [body(opcode, prefixed) for _, opcode, prefixed in instructions]
+	written = set()
+	for lines in bodies:
+		written.update(registers_used(lines)[1])
+
+	period = 0
+	defined = set()
+	for (addr, opcode, prefixed), lines in zip(instructions, bodies):
+		source = '\n'.join(lines)
+		if 'write' in source or 'cpu.' in source or 'raise' in source:
+			return 0
+		if 'read8' in source or 'read16' in source:
+			operands = [operand for operand in opcode.operands if operand in _OPERANDS]
+			if len(operands) != 1 or 'read16' in source:
+				return 0
+			if operands[0] == '(a16)' and not _quiet(read8(addr + 1) | (read8(addr + 2) << 8)):
+				return 0
+			if operands[0] == '(a8)' and not _quiet(0xff00 | read8(addr + 1)):
+				return 0
+		reads, writes = registers_used(lines)
+		for register in reads:
+			if register in written and register not in defined:
+				return 0
+		defined.update(writes)
+		cycles = opcode.cycles
+		period += cycles[0] if isinstance(cycles, tuple) else cycles
+	return period
@@ -0,0 +1,50 @@
+from mmu import INT_JOYPAD
+
+# Button bits in `pressed`: the direction keys, then the action buttons, in
+# the order P1 reports them
+BUTTON_RIGHT = 0x01
+BUTTON_LEFT = 0x02
+BUTTON_UP = 0x04
+BUTTON_DOWN = 0x08
+BUTTON_A = 0x10
+BUTTON_B = 0x20
+BUTTON_SELECT = 0x40
+BUTTON_START = 0x80
+
+
+# The buttons, read through P1 (0xff00): the game selects the direction keys
+# with bit 4 low and the action buttons with bit 5 low, and reads the
+# selected keys back in the low four bits, 0 meaning pressed.
+class Joypad():
+	def __init__(self, mmu):
+		self._mmu = mmu
+		self._select = 0x30
+		self.pressed = 0
+		mmu.io_handler(0x00, self._reg_p1_set, self._reg_p1)
+
+
+	def press(self, buttons):
+		if buttons & ~self.pressed:
+			self._mmu.request_interrupt(INT_JOYPAD)
+		self.pressed |= buttons
+
+
+	def release(self, buttons):
+		self.pressed &= ~buttons
+
+
+	###
+	# Register access functions
+	###
+
+	def _reg_p1(self):
+		keys = 0
+		if not self._select & 0x10:
+			keys |= self.pressed & 0x0f
+		if not self._select & 0x20:
+			keys |= self.pressed >> 4
+		return 0xc0 | self._select | (~keys & 0x0f)
+
+
+	def _reg_p1_set(self, value):
+		self._select = value & 0x30
@@ -1,14 +1,32 @@
 from sys import argv
 from gameboy import GameBoy
-
-
-gameboy = GameBoy()
+from tracing import make_tracer
+import flagcheck
 
 
 def main():
-	with open(argv[1]) as f:
+	tracer = None
+	profile = None
+	renderer = 'python'
+	render_every = 1
+	for arg in argv[2:]:
+		if arg.startswith('--trace='):
+			tracer = make_tracer(arg[len('--trace='):])
+		elif arg.startswith('--profile='):
+			profile = arg[len('--profile='):]
+		elif arg.startswith('--renderer='):
+			renderer = arg[len('--renderer='):]
+		elif arg.startswith('--render-every='):
+			render_every = int(arg[len('--render-every='):])
+	if '--check-flags' in argv[2:]:
+		with open(argv[1], 'rb') as f:
+			flagcheck.check_rom(f)
+		return
+	gameboy = GameBoy(recompile='--recompile' in argv[2:], tracer=tracer, profile=profile,
+			lazy_flags='--lazy-flags' in argv[2:], renderer=renderer)
+	with open(argv[1], 'rb') as f:
 		gameboy.loadRom(f)
-	gameboy.run()
+	gameboy.run(render_every)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,252 @@
+from time import time
+from saveram import BatteryRAM, FLUSH_INTERVAL
+
+RAM_BANK_SIZE = 0x2000
+
+
+# Memory bank controllers. Writes to the ROM area land in write(addr, value),
+# and switching banks just points the MMU's page table at a different set of
+# precomputed memoryviews, so it costs the same whatever the bank.
+#
+# The base class is a cartridge with no controller: 32 KB of ROM and at most
+# 8 KB of RAM, always there.
+#
+# RAM is a bytearray, or with a battery the mapped save file from `battery`
+# (a saveram.BatteryRAM), whose pages are marked dirty as they're written.
+class MBC():
+	def __init__(self, mmu, cartridge, battery=None):
+		self._mmu = mmu
+		self._cartridge = cartridge
+		self._battery = battery
+		if battery:
+			self.ram = battery.data
+			self._dirty = battery.dirty
+		else:
+			self.ram = bytearray(self.ram_size(cartridge))
+			self._dirty = None
+		self._ram_banks = [mmu.ram_pages(memoryview(self.ram)[addr:addr + RAM_BANK_SIZE], self._dirty, addr >> 8)
+				for addr in range(0, len(self.ram), RAM_BANK_SIZE)]
+		self._ram_enabled = False
+		self._ram_mapped = False
+		self._start()
+
+
+	# Bytes of RAM the cartridge has, as mapped in whole 8 KB banks
+	@staticmethod
+	def ram_size(cartridge):
+		return max(cartridge.ram_size, RAM_BANK_SIZE) if cartridge.has_ram else 0
+
+
+	def _start(self):
+		self._ram_enabled = True
+		self._map_ram(0)
+
+
+	def write(self, addr, value):
+		pass
+
+
+	def close(self):
+		if self._battery:
+			self._battery.close()
+
+
+	def _map_ram(self, bank):
+		if self._ram_enabled and self._ram_banks:
+			self._map_ram_pages(self._ram_banks[bank % len(self._ram_banks)])
+		else:
+			self._map_ram_pages(None)
+
+
+	# Only touches the page table if something different is going in
+	def _map_ram_pages(self, pages):
+		if pages is not self._ram_mapped:
+			self._ram_mapped = pages
+			self._mmu.map_ram(pages)
+
+
+class MBC1(MBC):
+	def _start(self):
+		self._low = 1
+		self._high = 0
+		self._mode = 0
+		self._map_ram(0)
+
+
+	def write(self, addr, value):
+		if addr < 0x2000:
+			self._ram_enabled = value & 0x0f == 0x0a
+		elif addr < 0x4000:
+			self._low = value & 0x1f or 1
+			self._map_rom()
+			return
+		elif addr < 0x6000:
+			self._high = value & 0x03
+			self._map_rom()
+		else:
+			self._mode = value & 0x01
+			self._map_rom()
+		# In mode 1 the two high bits also pick the RAM bank
+		self._map_ram(self._high if self._mode else 0)
+
+
+	# ...and the ROM bank at 0x0000
+	def _map_rom(self):
+		high = self._high << 5
+		self._mmu.map_rom(high if self._mode else 0, high | self._low)
+
+
+# MBC2 has 512 four-bit RAM cells built in, repeated through 0xa000-0xbfff,
+# and bit 8 of the address picks between its two registers
+class MBC2(MBC):
+	@staticmethod
+	def ram_size(cartridge):
+		return 0x200
+
+
+	def _start(self):
+		self._ram_banks = [self._mmu.ram_handler_pages(self._read_ram, self._write_ram)]
+		self._map_ram(0)
+
+
+	def write(self, addr, value):
+		if addr >= 0x4000:
+			return
+		if addr & 0x100:
+			self._mmu.map_rom(0, value & 0x0f or 1)
+		else:
+			self._ram_enabled = value & 0x0f == 0x0a
+			self._map_ram(0)
+
+
+	def _read_ram(self, addr):
+		return self.ram[addr & 0x1ff] | 0xf0
+
+
+	def _write_ram(self, addr, value):
+		self.ram[addr & 0x1ff] = value & 0x0f
+		if self._dirty is not None:
+			self._dirty[(addr & 0x1ff) >> 8] = 1
+
+
+# MBC3 adds a real time clock, whose registers are mapped at 0xa000 instead of
+# RAM by selecting 0x08-0x0c. The clock runs off the host's: it is kept as
+# the time it would have read zero, and only turned into registers when the
+# game latches it.
+class MBC3(MBC):
+	def _start(self):
+		self._ram_select = 0
+		self._rtc_pages = self._mmu.ram_handler_pages(self._read_rtc, self._write_rtc)
+		self._rtc_origin = time()
+		self._rtc_halted_at = None
+		self._rtc_carry = 0
+		self._latched = [0] * 5
+		self._latch_armed = False
+		self._map_ram(0)
+
+
+	def write(self, addr, value):
+		if addr < 0x2000:
+			self._ram_enabled = value & 0x0f == 0x0a
+			self._map_ram(self._ram_select)
+		elif addr < 0x4000:
+			self._mmu.map_rom(0, value & 0x7f or 1)
+		elif addr < 0x6000:
+			self._ram_select = value & 0x0f
+			self._map_ram(self._ram_select)
+		else:
+			if self._latch_armed and value == 1:
+				self._latched = self._rtc_registers()
+			self._latch_armed = value == 0
+
+
+	def _map_ram(self, bank):
+		if 0x08 <= bank <= 0x0c and self._cartridge.rtc:
+			self._map_ram_pages(self._rtc_pages if self._ram_enabled else None)
+		else:
+			MBC._map_ram(self, bank & 0x03)
+
+
+	def _seconds(self):
+		return int((self._rtc_halted_at or time()) - self._rtc_origin)
+
+
+	# Seconds, minutes, hours, day counter low byte, and day counter high bit
+	# with the halt and day carry flags
+	def _rtc_registers(self):
+		seconds = self._seconds()
+		days = seconds // 86400
+		if days > 0x1ff:
+			self._rtc_carry = 1
+			days &= 0x1ff
+			self._rtc_origin += 512 * 86400
+		return [
+			seconds % 60,
+			seconds // 60 % 60,
+			seconds // 3600 % 24,
+			days & 0xff,
+			(days >> 8) | (0x40 if self._rtc_halted_at else 0) | (self._rtc_carry << 7),
+		]
+
+
+	def _read_rtc(self, addr):
+		return self._latched[self._ram_select - 0x08]
+
+
+	# Writing a register sets the running clock, from the current time with
+	# that one field replaced
+	def _write_rtc(self, addr, value):
+		registers = self._rtc_registers()
+		registers[self._ram_select - 0x08] = value
+		seconds, minutes, hours, low, high = registers
+		days = ((high & 0x01) << 8) | low
+		total = ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+		now = time()
+		self._rtc_carry = high >> 7
+		self._rtc_halted_at = now if high & 0x40 else None
+		self._rtc_origin = now - total
+		self._latched[self._ram_select - 0x08] = value
+
+
+class MBC5(MBC):
+	def _start(self):
+		self._bank = 1
+		self._ram_bank = 0
+		self._map_ram(0)
+
+
+	def write(self, addr, value):
+		if addr < 0x2000:
+			self._ram_enabled = value & 0x0f == 0x0a
+		elif addr < 0x3000:
+			self._bank = (self._bank & 0x100) | value
+			self._mmu.map_rom(0, self._bank)
+			return
+		elif addr < 0x4000:
+			self._bank = ((value & 0x01) << 8) | (self._bank & 0xff)
+			self._mmu.map_rom(0, self._bank)
+			return
+		elif addr < 0x6000:
+			self._ram_bank = value & 0x0f
+		else:
+			return
+		self._map_ram(self._ram_bank)
+
+
+_MBCS = {
+	None: MBC,
+	'MBC1': MBC1,
+	'MBC2': MBC2,
+	'MBC3': MBC3,
+	'MBC5': MBC5,
+}
+
+
+# Battery RAM is kept in `save_path` if there is one
+def make_mbc(mmu, cartridge, save_path=None, save_interval=FLUSH_INTERVAL):
+	mbc = _MBCS[cartridge.mbc]
+	size = mbc.ram_size(cartridge)
+	battery = None
+	if cartridge.battery and size and save_path:
+		battery = BatteryRAM(save_path, size, save_interval)
+	return mbc(mmu, cartridge, battery)
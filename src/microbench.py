@@ -0,0 +1,69 @@
+from time import time
+from timeit import timeit
+from gameboy import GameBoy
+
+# Immediate- and stack-heavy guest loop: 16-bit loads, absolute stores and
+# loads, CALL/RET and PUSH/POP, round and round
+_PROGRAM = bytes([
+	0x31, 0xf0, 0xdf,		# LD SP,0xdff0
+	0x01, 0x34, 0x12,		# loop: LD BC,0x1234
+	0x11, 0x78, 0x56,		# LD DE,0x5678
+	0x21, 0x00, 0xc0,		# LD HL,0xc000
+	0xea, 0x10, 0xc0,		# LD (0xc010),A
+	0xfa, 0x10, 0xc0,		# LD A,(0xc010)
+	0x08, 0x20, 0xc0,		# LD (0xc020),SP
+	0xc5,				# PUSH BC
+	0xd5,				# PUSH DE
+	0xcd, 0x00, 0x02,		# CALL 0x0200
+	0xd1,				# POP DE
+	0xc1,				# POP BC
+	0xc3, 0x03, 0x01,		# JP loop
+])
+_ROUTINE = bytes([
+	0xe5,				# PUSH HL
+	0xe1,				# POP HL
+	0xc9,				# RET
+])
+
+
+def _machine(recompile):
+	gameboy = GameBoy(recompile=recompile)
+	rom = gameboy._mmu._rom
+	rom[0x100:0x100 + len(_PROGRAM)] = _PROGRAM
+	rom[0x200:0x200 + len(_ROUTINE)] = _ROUTINE
+	return gameboy
+
+
+# Calls per second of the raw MMU and CPU 16-bit primitives, on a page
+# boundary and off it
+def bench_primitives(number=200000):
+	mmu = GameBoy()._mmu
+	results = []
+	for name, statement in (
+			('read16', 'mmu.read16(0xc010)'),
+			('read16 across pages', 'mmu.read16(0xc0ff)'),
+			('write16', 'mmu.write16(0xc010, 0x1234)'),
+			('write16 across pages', 'mmu.write16(0xc0ff, 0x1234)')):
+		seconds = timeit(statement, globals={'mmu': mmu}, number=number)
+		results.append((name, number / seconds))
+	return results
+
+
+# Guest instructions per second running _PROGRAM for `cycles` cycles
+def bench_program(recompile, cycles=2000000):
+	gameboy = _machine(recompile)
+	cpu = gameboy._cpu
+	start = time()
+	cpu.run_for(cycles)
+	return cpu.instruction_count / (time() - start)
+
+
+def main():
+	for name, rate in bench_primitives():
+		print('%-22s %12.0f/sec' % (name, rate))
+	for recompile in (False, True):
+		print('%-22s %12.0f instructions/sec' % ('recompiled' if recompile else 'interpreted', bench_program(recompile)))
+
+
+if __name__ == '__main__':
+	main()
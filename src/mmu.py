@@ -1,35 +1,431 @@
-import struct
+import os
+from cartridge import Cartridge
+from mbc import make_mbc
+from saveram import FLUSH_INTERVAL
+
+# Interrupt request bits in IF (0xff0f) and IE (0xffff)
+INT_VBLANK = 0x01
+INT_STAT = 0x02
+INT_TIMER = 0x04
+INT_SERIAL = 0x08
+INT_JOYPAD = 0x10
+
+# I/O register values left behind by the DMG boot ROM
+_POST_BOOT_IO = {
+	0x05: 0x00, # TIMA
+	0x06: 0x00, # TMA
+	0x07: 0xf8, # TAC
+	0x0f: 0xe1, # IF
+	0x40: 0x91, # LCDC
+	0x41: 0x85, # STAT
+	0x42: 0x00, # SCY
+	0x43: 0x00, # SCX
+	0x45: 0x00, # LYC
+	0x47: 0xfc, # BGP
+	0x48: 0xff, # OBP0
+	0x49: 0xff, # OBP1
+	0x4a: 0x00, # WY
+	0x4b: 0x00, # WX
+	0xff: 0x00, # IE
+}
+
+# The memory map, one entry per page (high address byte). Reads and writes of
+# RAM and ROM are a single index into a 256-byte memoryview over the buffer
+# behind that page. Pages whose accesses have side effects (ROM writes, and
+# RAM pages holding translated code) get a HandlerPage instead, which looks
+# the same from read8/write8 but calls out, and the I/O page gets an IOPage.
+class HandlerPage():
+	__slots__ = ('_base', '_read', '_write')
+
+	def __init__(self, page, read, write):
+		self._base = page << 8
+		self._read = read
+		self._write = write
+
+
+	def __getitem__(self, offset):
+		return self._read(self._base | offset)
+
+
+	def __setitem__(self, offset, value):
+		self._write(self._base | offset, value)
+
+
+# The I/O page: hardware registers, HRAM and IE. Registers with side effects
+# have a read and/or write handler in the 256-entry tables, indexed by
+# addr & 0xff; everything else is a plain store in `_io`.
+class IOPage():
+	__slots__ = ('_io', '_reads', '_writes')
+
+	def __init__(self, io, reads, writes):
+		self._io = io
+		self._reads = reads
+		self._writes = writes
+
+
+	def __getitem__(self, offset):
+		read = self._reads[offset]
+		return self._io[offset] if read is None else read()
+
+
+	def __setitem__(self, offset, value):
+		write = self._writes[offset]
+		if write is None:
+			self._io[offset] = value
+		else:
+			write(value)
+
+
+# Write side of a battery-backed RAM page: stores, then marks the page dirty
+# for the save file flusher
+class DirtyPage():
+	__slots__ = ('_view', '_dirty', '_index')
+
+	def __init__(self, view, dirty, index):
+		self._view = view
+		self._dirty = dirty
+		self._index = index
+
+
+	def __setitem__(self, offset, value):
+		self._view[offset] = value
+		self._dirty[self._index] = 1
+
+
+# Write side of a VRAM tile data page: stores, then marks the 16-byte tile
+# written for the renderer to decode again
+class TilePage():
+	__slots__ = ('_view', '_dirty', '_first')
+
+	def __init__(self, view, dirty, first):
+		self._view = view
+		self._dirty = dirty
+		self._first = first
+
+
+	def __setitem__(self, offset, value):
+		self._view[offset] = value
+		self._dirty[self._first | (offset >> 4)] = 1
+
+
+def _pages(buffer, count):
+	view = memoryview(buffer)
+	return [view[offset:offset + 0x100] for offset in range(0, count << 8, 0x100)]
+
 
 class MMU():
-	def __init__(self):
-		self._ram = bytearray(0xf0000)
+	# Battery RAM is flushed to the save file every `save_interval` seconds
+	def __init__(self, save_interval=FLUSH_INTERVAL):
+		self._save_interval = save_interval
+		self._rom = bytearray(0x8000)
+		self._eram = bytearray(0x2000)
+		self._wram = bytearray(0x2000)
+		# The renderer reads VRAM and OAM straight from here
+		self.vram = bytearray(0x2000)
+		self.oam = bytearray(0x100)
+		# I/O registers, HRAM and IE: the whole 0xff00 page
+		self._io = bytearray(0x100)
+		for reg, value in _POST_BOOT_IO.items():
+			self._io[reg] = value
+		self.cartridge = None
+		# ROM banks mapped at 0x0000 and 0x4000
+		self.rom_bank0 = 0
+		self.rom_bank = 1
+		self._mbc = None
+		# Page views of each ROM bank, made the first time it's mapped
+		self._bank_pages = []
+
+		self._read_pages = [None] * 0x100
+		self._write_pages = [None] * 0x100
+		# What each page maps to for writes when it isn't being watched
+		self._write_mapped = [None] * 0x100
+		self._map(0x00, _pages(self._rom, 0x80), [HandlerPage(page, None, self._write_rom) for page in range(0x80)])
+		self._unmapped = [HandlerPage(page, self._read_unmapped, self._write_unmapped) for page in range(0x100)]
+		vram = _pages(self.vram, 0x20)
+		# Which of the 384 tiles at 0x8000-0x97ff have been written since the
+		# renderer last decoded them
+		self.tiles_dirty = bytearray(b'\x01' * 384)
+		self._map(0x80, vram, [TilePage(view, self.tiles_dirty, page << 4) for page, view in enumerate(vram[:0x18])] + vram[0x18:])
+		self._map(0xa0, _pages(self._eram, 0x20))
+		wram = _pages(self._wram, 0x20)
+		self._map(0xc0, wram)
+		# Echo RAM mirrors work RAM up to 0xfdff
+		self._map(0xe0, wram[:0x1e])
+		# Set whenever OAM is written, for the renderer's sprite index
+		self.oam_written = bytearray(b'\x01')
+		self._oam_pages = _pages(self.oam, 1)
+		self._oam_writes = [DirtyPage(self._oam_pages[0], self.oam_written, 0)]
+		self._map(0xfe, self._oam_pages, self._oam_writes)
+		# Handlers for I/O registers with side effects, indexed by
+		# addr & 0xff. A read handler returns the register's value, computed
+		# when asked rather than kept up to date; a write handler stores the
+		# value itself (via write_io) if it needs storing.
+		self._io_reads = [None] * 0x100
+		self._io_writes = [None] * 0x100
+		self._map(0xff, [IOPage(self._io, self._io_reads, self._io_writes)])
+		# Where HRAM writes go: straight into `_io`, or through the watch on
+		# the I/O page while code translated from HRAM is being kept
+		self._hram_writes = self._io
+		# Who to tell when a page holding translated or analysed code is
+		# written
+		self._code_listeners = []
 
 
-	def loadRom(self, romFile):
+	# Maps the pages from `first` on to the views in `reads`, and to those in
+	# `writes` for writes if given (read-only memory) or the same views if not.
+	# Code translated from a page that gets something else mapped in is
+	# thrown away, as if the page had been written.
+	def _map(self, first, reads, writes=None):
+		writes = writes or reads
+		for page, (read, write) in enumerate(zip(reads, writes), first):
+			watched = self._write_pages[page] is not self._write_mapped[page]
+			self._read_pages[page] = read
+			self._write_pages[page] = write
+			self._write_mapped[page] = write
+			if watched:
+				for listener in self._code_listeners:
+					listener(page << 8)
+
+
+	# Battery RAM is kept in a .sav file next to the ROM, unless `save` is
+	# False, when it's private to this MMU and thrown away
+	def loadRom(self, romFile, save=True):
 		print('Loading ROM...')
-		addr = 0
-		byte = romFile.read(1)
-		while byte:
-			self._ram[addr] = byte
-			addr += 1
-			byte = romFile.read(1)
-		print('Read ' + str(addr) + ' bytes')
+		cartridge = Cartridge(romFile)
+		self.cartridge = cartridge
+		self._bank_pages = [None] * len(cartridge.banks)
+		self.rom_bank0 = self.rom_bank = None
+		self.map_rom(0, 1)
+		save_path = os.path.splitext(romFile.name)[0] + '.sav' if save and hasattr(romFile, 'name') else None
+		self._mbc = make_mbc(self, cartridge, save_path, self._save_interval)
+		print('Mapped ' + str(len(cartridge.banks)) + ' ROM banks of "' + cartridge.title + '" (' +
+				(cartridge.mbc or 'no MBC') + ', ' + str(cartridge.ram_size) + ' bytes RAM)')
+		if not cartridge.header_ok():
+			print('Warning: bad header checksum')
 
 
+	# HRAM (0xff80-0xfffe) shares the I/O page but never has handlers, so it's
+	# indexed straight out of `_io` rather than through the IOPage, the same
+	# as any other RAM. Writes only take the watch on the page into account.
 	def read8(self, addr):
-		return self._ram[addr]
+		if 0xff80 <= addr < 0xffff:
+			return self._io[addr & 0xff]
+		return self._read_pages[addr >> 8][addr & 0xff]
 
 
 	def read8_signed(self, addr):
-		value = self._ram[addr]
+		value = self.read8(addr)
 		if value > 127:
 			value -= 256
 		return value
 
 
+	# Both bytes come from one page lookup unless the word straddles two
+	# pages, which then each go through their own view or handler
 	def read16(self, addr):
-		return struct.unpack('<H', self._ram[addr:addr+2])[0]
+		offset = addr & 0xff
+		if 0xff80 <= addr < 0xfffe:
+			return self._io[offset] | (self._io[offset + 1] << 8)
+		if offset != 0xff:
+			page = self._read_pages[addr >> 8]
+			return page[offset] | (page[offset + 1] << 8)
+		return self._read_pages[addr >> 8][0xff] | (self._read_pages[((addr >> 8) + 1) & 0xff][0] << 8)
 
 
 	def write8(self, addr, value):
-		self._ram[addr] = value
\ No newline at end of file
+		if 0xff80 <= addr < 0xffff:
+			self._hram_writes[addr & 0xff] = value
+		else:
+			self._write_pages[addr >> 8][addr & 0xff] = value
+
+
+	# Low byte first, like LD (a16),SP
+	def write16(self, addr, value):
+		offset = addr & 0xff
+		if 0xff80 <= addr < 0xfffe:
+			hram = self._hram_writes
+			hram[offset] = value & 0xff
+			hram[offset + 1] = value >> 8
+		elif offset != 0xff:
+			page = self._write_pages[addr >> 8]
+			page[offset] = value & 0xff
+			page[offset + 1] = value >> 8
+		else:
+			self._write_pages[addr >> 8][0xff] = value & 0xff
+			self._write_pages[((addr >> 8) + 1) & 0xff][0] = value >> 8
+
+
+	# High byte first, as PUSH writes it: SP - 1, then SP - 2
+	def write16_high_first(self, addr, value):
+		offset = addr & 0xff
+		if 0xff80 <= addr < 0xfffe:
+			hram = self._hram_writes
+			hram[offset + 1] = value >> 8
+			hram[offset] = value & 0xff
+		elif offset != 0xff:
+			page = self._write_pages[addr >> 8]
+			page[offset + 1] = value >> 8
+			page[offset] = value & 0xff
+		else:
+			self._write_pages[((addr >> 8) + 1) & 0xff][0] = value >> 8
+			self._write_pages[addr >> 8][0xff] = value & 0xff
+
+
+	# `length` bytes from `addr` on, as a view straight onto the memory behind
+	# them if they're all in one plain page, or read one by one through the
+	# handlers if not
+	def read_block(self, addr, length):
+		page = self._read_pages[addr >> 8]
+		offset = addr & 0xff
+		if isinstance(page, memoryview) and offset + length <= 0x100:
+			return page[offset:offset + length]
+		return bytes([self.read8((addr + i) & 0xffff) for i in range(length)])
+
+
+	###
+	# DMA
+	###
+
+	# OAM DMA: 160 bytes from `source` into OAM, as one copy
+	def copy_to_oam(self, source):
+		self.oam[:0xa0] = self.read_block(source, 0xa0)
+		self.oam_written[0] = 1
+
+
+	# HDMA: `length` bytes from `source` to `dest` in VRAM, as one slice copy
+	# as long as the source is inside one page and the destination doesn't
+	# run past the end of VRAM
+	def copy_to_vram(self, source, dest, length):
+		dest &= 0x1fff
+		self.vram[dest:dest + length] = self.read_block(source, length)
+		if dest < 0x1800:
+			first = dest >> 4
+			last = min((dest + length + 0xf) >> 4, 384)
+			self.tiles_dirty[first:last] = b'\x01' * (last - first)
+
+
+	# While OAM DMA runs the PPU has OAM to itself: the CPU reads 0xff there
+	# and its writes go nowhere
+	def lock_oam(self, locked):
+		if locked:
+			self._map(0xfe, [self._unmapped[0xfe]])
+		else:
+			self._map(0xfe, self._oam_pages, self._oam_writes)
+
+
+	###
+	# Banking, for the memory bank controllers
+	###
+
+	# Maps ROM banks `low` at 0x0000 and `high` at 0x4000. Bank numbers wrap
+	# at the number of banks the ROM has, like the unused high bank lines do.
+	def map_rom(self, low, high):
+		count = len(self._bank_pages)
+		low %= count
+		high %= count
+		if low != self.rom_bank0:
+			self._read_pages[0x00:0x40] = self._rom_pages(low)
+			self.rom_bank0 = low
+		if high != self.rom_bank:
+			self._read_pages[0x40:0x80] = self._rom_pages(high)
+			self.rom_bank = high
+
+
+	def _rom_pages(self, bank):
+		pages = self._bank_pages[bank]
+		if pages is None:
+			pages = self._bank_pages[bank] = _pages(self.cartridge.banks[bank], 0x40)
+		return pages
+
+
+	# Splits an 8 KB buffer into (read, write) views for map_ram. With
+	# `dirty`, writes also mark dirty[first + page] for each 256-byte page.
+	def ram_pages(self, buffer, dirty=None, first=0):
+		reads = _pages(buffer, 0x20)
+		if dirty is None:
+			return reads, reads
+		return reads, [DirtyPage(view, dirty, first + page) for page, view in enumerate(reads)]
+
+
+	# Maps pages from ram_pages at 0xa000, or nothing (reads give 0xff) if
+	# pages is None
+	def map_ram(self, pages):
+		if pages:
+			self._map(0xa0, *pages)
+		else:
+			self._map(0xa0, self._unmapped[0xa0:0xc0])
+
+
+	# Pages for map_ram that send every access through read(addr) and
+	# write(addr, value), for RAM that isn't plain bytes and clock registers
+	def ram_handler_pages(self, read, write):
+		pages = [HandlerPage(page, read, write) for page in range(0xa0, 0xc0)]
+		return pages, pages
+
+
+	# Flushes battery RAM and stops its flusher
+	def close(self):
+		if self._mbc:
+			self._mbc.close()
+
+
+	###
+	# Handler pages
+	###
+
+	def _read_unmapped(self, addr):
+		return 0xff
+
+
+	def _write_unmapped(self, addr, value):
+		pass
+
+
+	# Cartridge ROM is read-only; writes to it program the bank controller
+	def _write_rom(self, addr, value):
+		if self._mbc:
+			self._mbc.write(addr, value)
+
+
+	# A write to a watched page goes through as normal, then unwatches the
+	# page and tells the listeners
+	def _write_code(self, addr, value):
+		page = addr >> 8
+		self._write_pages[page] = self._write_mapped[page]
+		if page == 0xff:
+			self._hram_writes = self._io
+		self._write_pages[page][addr & 0xff] = value
+		for listener in self._code_listeners:
+			listener(addr)
+
+
+	# Writes to ROM never change it, so only RAM pages need watching
+	def watch_code(self, page, listener):
+		if page >= 0x80 and self._write_pages[page] is self._write_mapped[page]:
+			self._write_pages[page] = HandlerPage(page, None, self._write_code)
+			if page == 0xff:
+				self._hram_writes = self._write_pages[page]
+		if listener not in self._code_listeners:
+			self._code_listeners.append(listener)
+
+
+	# Routes reads and/or writes of I/O register `reg` through handlers
+	def io_handler(self, reg, write=None, read=None):
+		if write:
+			self._io_writes[reg] = write
+		if read:
+			self._io_reads[reg] = read
+
+
+	# Raw I/O register access that bypasses the handlers, for the hardware
+	# that owns the register
+	def read_io(self, reg):
+		return self._io[reg]
+
+
+	def write_io(self, reg, value):
+		self._io[reg] = value
+
+
+	def request_interrupt(self, bit):
+		self.write8(0xff0f, self._io[0x0f] | bit)
@@ -0,0 +1,158 @@
+import numpy
+from renderer import Renderer, WIDTH, HEIGHT, TILE_COUNT
+
+_COLUMNS = numpy.arange(WIDTH)
+
+# Bit offset of each colour index's shade in a palette register
+_SHIFTS = numpy.arange(4) * 2
+
+# Pixel offsets of each tile a map entry names, with LCDC bit 4 clear (tiles
+# -128-127 from 0x9000) and then set (tiles 0-255 from 0x8000)
+_TILE_PIXELS = numpy.array([(256 + ((tile ^ 0x80) - 0x80)) << 6 for tile in range(256)] +
+		[tile << 6 for tile in range(256)])
+
+_SPRITE_COLUMNS = numpy.arange(8)
+
+# Columns of the per-line register state kept for the frame
+_LCDC, _SCY, _SCX, _WX, _BGP, _OBP0, _OBP1, _WINDOW = range(8)
+
+
+# Renderer that draws the whole frame at once with NumPy at VBlank. Each line
+# only records the registers it's drawn with as it goes by, so scroll,
+# palette and LCDC changes part way down the screen still come out; VRAM and
+# OAM are as they are at VBlank. The background and window are gathered from
+# the tile maps into the decoded tiles in one go, and sprite priority is
+# worked out with masks. A frame drawn from the same registers, maps, tiles
+# and OAM as the one last drawn into the same buffer isn't drawn again.
+class NumpyRenderer(Renderer):
+	def __init__(self, mmu):
+		# What each buffer drawn into was last drawn from
+		self._frame_keys = {}
+		Renderer.__init__(self, mmu)
+		self._vram_array = numpy.frombuffer(mmu.vram, numpy.uint8)
+		self._oam_array = numpy.frombuffer(mmu.oam, numpy.uint8)
+		self._dirty_array = numpy.frombuffer(mmu.tiles_dirty, numpy.uint8)
+		# Colour index of every pixel of every tile
+		self._tiles = numpy.zeros((TILE_COUNT, 8, 8), numpy.uint8)
+		# Register state each line was drawn with, or None if it wasn't, kept
+		# in plain Python until VBlank as that's cheaper to fill in
+		self._state = [None] * HEIGHT
+
+
+	def target(self, frame):
+		self.frame = frame
+		self._frame_key = self._frame_keys.get(id(frame))
+		self._pixels = numpy.frombuffer(frame, numpy.uint8).reshape(HEIGHT, WIDTH)
+
+
+	def render_line(self, ly):
+		read_io = self._mmu.read_io
+		lcdc = read_io(0x40)
+		wx = read_io(0x4b)
+		if ly == 0:
+			self._window_line = 0
+		window = -1
+		if lcdc & 0x21 == 0x21 and read_io(0x4a) <= ly and wx < WIDTH + 7:
+			window = self._window_line
+			self._window_line += 1
+		self._state[ly] = (lcdc, read_io(0x42), read_io(0x43), wx,
+				read_io(0x47), read_io(0x48), read_io(0x49), window)
+
+
+	def finish_frame(self):
+		drawn = [ly for ly in range(HEIGHT) if self._state[ly]]
+		if not drawn:
+			return
+		self._decode()
+		mmu = self._mmu
+		key = (tuple(self._state), mmu.vram[0x1800:0x2000], mmu.oam[:0xa0], self._tile_generation)
+		if key == self._frame_key:
+			self._state = [None] * HEIGHT
+			return
+		self._frame_keys[id(self.frame)] = self._frame_key = key
+		lines = numpy.array(drawn)
+		state = numpy.array([self._state[ly] for ly in drawn], numpy.int32)
+		self._state = [None] * HEIGHT
+		lcdc = state[:, _LCDC]
+		colours = self._background(lines, state)
+		# The background and window are blank white when turned off
+		background_off = lcdc & 0x01 == 0
+		colours[background_off] = 0
+		shades = (state[:, _BGP, None] >> _SHIFTS) & 3
+		shades[background_off] = 0
+		out = numpy.take_along_axis(shades, colours.astype(numpy.intp), axis=1)
+		self._sprites(lines, state, colours, out)
+		self._pixels[lines] = out
+
+
+	def _decode(self):
+		dirty = numpy.flatnonzero(self._dirty_array)
+		if len(dirty):
+			self._dirty_array[dirty] = 0
+			data = self._vram_array[:TILE_COUNT << 4].reshape(TILE_COUNT, 8, 2)[dirty]
+			low = numpy.unpackbits(data[:, :, 0:1], axis=2)
+			high = numpy.unpackbits(data[:, :, 1:2], axis=2)
+			self._tiles[dirty] = low | (high << 1)
+			self._tile_generation += 1
+
+
+	# Colour indices at map pixel coordinates (`y` per line, `x` per line and
+	# column) in the map picked per line by `select`, as flat gathers: map
+	# entry, then tile, then pixel
+	def _map_colours(self, lcdc, select, y, x):
+		entries = self._vram_array.take(0x1800 + ((select << 10) | ((y >> 3) << 5))[:, None] + (x >> 3))
+		tiles = _TILE_PIXELS.take(entries + ((lcdc & 0x10) << 4)[:, None])
+		return self._tiles.ravel().take(tiles + ((y & 7) << 3)[:, None] + (x & 7))
+
+
+	def _background(self, lines, state):
+		lcdc = state[:, _LCDC]
+		y = (state[:, _SCY] + lines) & 0xff
+		x = (_COLUMNS + state[:, _SCX, None]) & 0xff
+		colours = self._map_colours(lcdc, (lcdc >> 3) & 1, y, x)
+		window = state[:, _WINDOW]
+		x = _COLUMNS - (state[:, _WX, None] - 7)
+		inside = (window >= 0)[:, None] & (x >= 0)
+		if inside.any():
+			colours = numpy.where(inside,
+					self._map_colours(lcdc, (lcdc >> 6) & 1, numpy.maximum(window, 0), numpy.maximum(x, 0)), colours)
+		return colours
+
+
+	# The same rules as Renderer._sprites, for every line at once: each line
+	# takes the first ten sprites in OAM that touch it, and each pixel goes to
+	# the highest priority sprite (furthest left, then earliest in OAM) that
+	# has a colour there, which shows unless it's behind a coloured background
+	def _sprites(self, lines, state, colours, out):
+		lcdc = state[:, _LCDC]
+		oam = self._oam_array[:0xa0].reshape(40, 4).astype(numpy.int32)
+		height = numpy.where(lcdc & 0x04, 16, 8)
+		rows = lines[:, None] - (oam[:, 0] - 16)
+		touching = (rows >= 0) & (rows < height[:, None]) & (lcdc & 0x02 != 0)[:, None]
+		touching &= numpy.cumsum(touching, axis=1) <= 10
+		line, sprite = numpy.nonzero(touching)
+		if not len(line):
+			return
+		y, x, tile, flags = oam[sprite].T
+		row = rows[line, sprite]
+		tall = height[line] == 16
+		row = numpy.where(flags & 0x40 != 0, height[line] - 1 - row, row)
+		tile = numpy.where(tall, tile & 0xfe, tile) + (row >> 3)
+		column = numpy.where((flags & 0x20 != 0)[:, None], 7 - _SPRITE_COLUMNS, _SPRITE_COLUMNS)
+		pixels = self._tiles.ravel().take(((tile << 6) | ((row & 7) << 3))[:, None] + column)
+		x = (x - 8)[:, None] + _SPRITE_COLUMNS
+		visible = (pixels != 0) & (x >= 0) & (x < WIDTH)
+		x = numpy.clip(x, 0, WIDTH - 1)
+		masked = (flags & 0x80 != 0)[:, None] & (colours[line[:, None], x] != 0)
+		palette = numpy.where(flags & 0x10 != 0, state[line, _OBP1], state[line, _OBP0])
+		shades = (palette[:, None] >> (pixels.astype(numpy.int32) << 1)) & 3
+
+		rank = numpy.empty(40, numpy.int32)
+		rank[numpy.lexsort((numpy.arange(40), oam[:, 1]))] = numpy.arange(40)
+		pixel = (line[:, None] * WIDTH + x)[visible]
+		order = numpy.lexsort((numpy.broadcast_to(rank[sprite][:, None], visible.shape)[visible], pixel))
+		pixel = pixel[order]
+		first = numpy.ones(len(pixel), bool)
+		first[1:] = pixel[1:] != pixel[:-1]
+		first &= ~masked[visible][order]
+		out.ravel()[pixel[first]] = shades[visible][order][first]
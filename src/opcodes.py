@@ -0,0 +1,648 @@
+import re
+from collections import namedtuple
+import alu
+
+
+class UnimplementedInstructionException(Exception):
+	pass
+
+
+# One entry per opcode. cycles is a (taken, not taken) pair for conditional
+# control flow, and flags lists the effect on Z, N, H and C in that order
+# ('-' unaffected, '0'/'1' forced, letter computed).
+Opcode = namedtuple('Opcode', 'code mnemonic operands length cycles flags')
+
+_R8 = ('B', 'C', 'D', 'E', 'H', 'L', '(HL)', 'A')
+_ALU = ('ADD', 'ADC', 'SUB', 'SBC', 'AND', 'XOR', 'OR', 'CP')
+_ALU_FLAGS = ('Z0HC', 'Z0HC', 'Z1HC', 'Z1HC', 'Z010', 'Z000', 'Z000', 'Z1HC')
+_SHIFTS = ('RLC', 'RRC', 'RL', 'RR', 'SLA', 'SRA', 'SWAP', 'SRL')
+
+
+def _base():
+	table = [
+		(0x00, 'NOP', (), 1, 4, '----'),
+		(0x01, 'LD', ('BC', 'd16'), 3, 12, '----'),
+		(0x02, 'LD', ('(BC)', 'A'), 1, 8, '----'),
+		(0x03, 'INC', ('BC',), 1, 8, '----'),
+		(0x04, 'INC', ('B',), 1, 4, 'Z0H-'),
+		(0x05, 'DEC', ('B',), 1, 4, 'Z1H-'),
+		(0x06, 'LD', ('B', 'd8'), 2, 8, '----'),
+		(0x07, 'RLCA', (), 1, 4, '000C'),
+		(0x08, 'LD', ('(a16)', 'SP'), 3, 20, '----'),
+		(0x09, 'ADD', ('HL', 'BC'), 1, 8, '-0HC'),
+		(0x0a, 'LD', ('A', '(BC)'), 1, 8, '----'),
+		(0x0b, 'DEC', ('BC',), 1, 8, '----'),
+		(0x0c, 'INC', ('C',), 1, 4, 'Z0H-'),
+		(0x0d, 'DEC', ('C',), 1, 4, 'Z1H-'),
+		(0x0e, 'LD', ('C', 'd8'), 2, 8, '----'),
+		(0x0f, 'RRCA', (), 1, 4, '000C'),
+		(0x10, 'STOP', ('0',), 2, 4, '----'),
+		(0x11, 'LD', ('DE', 'd16'), 3, 12, '----'),
+		(0x12, 'LD', ('(DE)', 'A'), 1, 8, '----'),
+		(0x13, 'INC', ('DE',), 1, 8, '----'),
+		(0x14, 'INC', ('D',), 1, 4, 'Z0H-'),
+		(0x15, 'DEC', ('D',), 1, 4, 'Z1H-'),
+		(0x16, 'LD', ('D', 'd8'), 2, 8, '----'),
+		(0x17, 'RLA', (), 1, 4, '000C'),
+		(0x18, 'JR', ('r8',), 2, 12, '----'),
+		(0x19, 'ADD', ('HL', 'DE'), 1, 8, '-0HC'),
+		(0x1a, 'LD', ('A', '(DE)'), 1, 8, '----'),
+		(0x1b, 'DEC', ('DE',), 1, 8, '----'),
+		(0x1c, 'INC', ('E',), 1, 4, 'Z0H-'),
+		(0x1d, 'DEC', ('E',), 1, 4, 'Z1H-'),
+		(0x1e, 'LD', ('E', 'd8'), 2, 8, '----'),
+		(0x1f, 'RRA', (), 1, 4, '000C'),
+		(0x20, 'JR', ('NZ', 'r8'), 2, (12, 8), '----'),
+		(0x21, 'LD', ('HL', 'd16'), 3, 12, '----'),
+		(0x22, 'LD', ('(HL+)', 'A'), 1, 8, '----'),
+		(0x23, 'INC', ('HL',), 1, 8, '----'),
+		(0x24, 'INC', ('H',), 1, 4, 'Z0H-'),
+		(0x25, 'DEC', ('H',), 1, 4, 'Z1H-'),
+		(0x26, 'LD', ('H', 'd8'), 2, 8, '----'),
+		(0x27, 'DAA', (), 1, 4, 'Z-0C'),
+		(0x28, 'JR', ('Z', 'r8'), 2, (12, 8), '----'),
+		(0x29, 'ADD', ('HL', 'HL'), 1, 8, '-0HC'),
+		(0x2a, 'LD', ('A', '(HL+)'), 1, 8, '----'),
+		(0x2b, 'DEC', ('HL',), 1, 8, '----'),
+		(0x2c, 'INC', ('L',), 1, 4, 'Z0H-'),
+		(0x2d, 'DEC', ('L',), 1, 4, 'Z1H-'),
+		(0x2e, 'LD', ('L', 'd8'), 2, 8, '----'),
+		(0x2f, 'CPL', (), 1, 4, '-11-'),
+		(0x30, 'JR', ('NC', 'r8'), 2, (12, 8), '----'),
+		(0x31, 'LD', ('SP', 'd16'), 3, 12, '----'),
+		(0x32, 'LD', ('(HL-)', 'A'), 1, 8, '----'),
+		(0x33, 'INC', ('SP',), 1, 8, '----'),
+		(0x34, 'INC', ('(HL)',), 1, 12, 'Z0H-'),
+		(0x35, 'DEC', ('(HL)',), 1, 12, 'Z1H-'),
+		(0x36, 'LD', ('(HL)', 'd8'), 2, 12, '----'),
+		(0x37, 'SCF', (), 1, 4, '-001'),
+		(0x38, 'JR', ('C', 'r8'), 2, (12, 8), '----'),
+		(0x39, 'ADD', ('HL', 'SP'), 1, 8, '-0HC'),
+		(0x3a, 'LD', ('A', '(HL-)'), 1, 8, '----'),
+		(0x3b, 'DEC', ('SP',), 1, 8, '----'),
+		(0x3c, 'INC', ('A',), 1, 4, 'Z0H-'),
+		(0x3d, 'DEC', ('A',), 1, 4, 'Z1H-'),
+		(0x3e, 'LD', ('A', 'd8'), 2, 8, '----'),
+		(0x3f, 'CCF', (), 1, 4, '-00C'),
+	]
+
+	# 0x40-0x7f: LD r, r' (with HALT where LD (HL), (HL) would be)
+	for code in range(0x40, 0x80):
+		dst = _R8[(code >> 3) & 7]
+		src = _R8[code & 7]
+		if code == 0x76:
+			table.append((code, 'HALT', (), 1, 4, '----'))
+		elif '(HL)' in (dst, src):
+			table.append((code, 'LD', (dst, src), 1, 8, '----'))
+		else:
+			table.append((code, 'LD', (dst, src), 1, 4, '----'))
+
+	# 0x80-0xbf: 8-bit ALU operations on A
+	for code in range(0x80, 0xc0):
+		op = (code >> 3) & 7
+		src = _R8[code & 7]
+		table.append((code, _ALU[op], ('A', src), 1, 8 if src == '(HL)' else 4, _ALU_FLAGS[op]))
+
+	table += [
+		(0xc0, 'RET', ('NZ',), 1, (20, 8), '----'),
+		(0xc1, 'POP', ('BC',), 1, 12, '----'),
+		(0xc2, 'JP', ('NZ', 'a16'), 3, (16, 12), '----'),
+		(0xc3, 'JP', ('a16',), 3, 16, '----'),
+		(0xc4, 'CALL', ('NZ', 'a16'), 3, (24, 12), '----'),
+		(0xc5, 'PUSH', ('BC',), 1, 16, '----'),
+		(0xc6, 'ADD', ('A', 'd8'), 2, 8, 'Z0HC'),
+		(0xc7, 'RST', ('00H',), 1, 16, '----'),
+		(0xc8, 'RET', ('Z',), 1, (20, 8), '----'),
+		(0xc9, 'RET', (), 1, 16, '----'),
+		(0xca, 'JP', ('Z', 'a16'), 3, (16, 12), '----'),
+		(0xcb, 'PREFIX', ('CB',), 1, 4, '----'),
+		(0xcc, 'CALL', ('Z', 'a16'), 3, (24, 12), '----'),
+		(0xcd, 'CALL', ('a16',), 3, 24, '----'),
+		(0xce, 'ADC', ('A', 'd8'), 2, 8, 'Z0HC'),
+		(0xcf, 'RST', ('08H',), 1, 16, '----'),
+		(0xd0, 'RET', ('NC',), 1, (20, 8), '----'),
+		(0xd1, 'POP', ('DE',), 1, 12, '----'),
+		(0xd2, 'JP', ('NC', 'a16'), 3, (16, 12), '----'),
+		(0xd3, 'ILLEGAL', (), 1, 4, '----'),
+		(0xd4, 'CALL', ('NC', 'a16'), 3, (24, 12), '----'),
+		(0xd5, 'PUSH', ('DE',), 1, 16, '----'),
+		(0xd6, 'SUB', ('A', 'd8'), 2, 8, 'Z1HC'),
+		(0xd7, 'RST', ('10H',), 1, 16, '----'),
+		(0xd8, 'RET', ('C',), 1, (20, 8), '----'),
+		(0xd9, 'RETI', (), 1, 16, '----'),
+		(0xda, 'JP', ('C', 'a16'), 3, (16, 12), '----'),
+		(0xdb, 'ILLEGAL', (), 1, 4, '----'),
+		(0xdc, 'CALL', ('C', 'a16'), 3, (24, 12), '----'),
+		(0xdd, 'ILLEGAL', (), 1, 4, '----'),
+		(0xde, 'SBC', ('A', 'd8'), 2, 8, 'Z1HC'),
+		(0xdf, 'RST', ('18H',), 1, 16, '----'),
+		(0xe0, 'LDH', ('(a8)', 'A'), 2, 12, '----'),
+		(0xe1, 'POP', ('HL',), 1, 12, '----'),
+		(0xe2, 'LD', ('(C)', 'A'), 1, 8, '----'),
+		(0xe3, 'ILLEGAL', (), 1, 4, '----'),
+		(0xe4, 'ILLEGAL', (), 1, 4, '----'),
+		(0xe5, 'PUSH', ('HL',), 1, 16, '----'),
+		(0xe6, 'AND', ('A', 'd8'), 2, 8, 'Z010'),
+		(0xe7, 'RST', ('20H',), 1, 16, '----'),
+		(0xe8, 'ADD', ('SP', 'r8'), 2, 16, '00HC'),
+		(0xe9, 'JP', ('HL',), 1, 4, '----'),
+		(0xea, 'LD', ('(a16)', 'A'), 3, 16, '----'),
+		(0xeb, 'ILLEGAL', (), 1, 4, '----'),
+		(0xec, 'ILLEGAL', (), 1, 4, '----'),
+		(0xed, 'ILLEGAL', (), 1, 4, '----'),
+		(0xee, 'XOR', ('A', 'd8'), 2, 8, 'Z000'),
+		(0xef, 'RST', ('28H',), 1, 16, '----'),
+		(0xf0, 'LDH', ('A', '(a8)'), 2, 12, '----'),
+		(0xf1, 'POP', ('AF',), 1, 12, 'ZNHC'),
+		(0xf2, 'LD', ('A', '(C)'), 1, 8, '----'),
+		(0xf3, 'DI', (), 1, 4, '----'),
+		(0xf4, 'ILLEGAL', (), 1, 4, '----'),
+		(0xf5, 'PUSH', ('AF',), 1, 16, '----'),
+		(0xf6, 'OR', ('A', 'd8'), 2, 8, 'Z000'),
+		(0xf7, 'RST', ('30H',), 1, 16, '----'),
+		(0xf8, 'LD', ('HL', 'SP+r8'), 2, 12, '00HC'),
+		(0xf9, 'LD', ('SP', 'HL'), 1, 8, '----'),
+		(0xfa, 'LD', ('A', '(a16)'), 3, 16, '----'),
+		(0xfb, 'EI', (), 1, 4, '----'),
+		(0xfc, 'ILLEGAL', (), 1, 4, '----'),
+		(0xfd, 'ILLEGAL', (), 1, 4, '----'),
+		(0xfe, 'CP', ('A', 'd8'), 2, 8, 'Z1HC'),
+		(0xff, 'RST', ('38H',), 1, 16, '----'),
+	]
+	table.sort()
+	return [Opcode(*entry) for entry in table]
+
+
+# CB-prefixed cycle counts include the 4 cycles spent on the prefix itself.
+def _cb():
+	table = []
+	for code in range(0x100):
+		target = _R8[code & 7]
+		bit = (code >> 3) & 7
+		memory = target == '(HL)'
+		if code < 0x40:
+			name = _SHIFTS[bit]
+			flags = 'Z000' if name == 'SWAP' else 'Z00C'
+			table.append((code, name, (target,), 2, 16 if memory else 8, flags))
+		elif code < 0x80:
+			table.append((code, 'BIT', (str(bit), target), 2, 12 if memory else 8, 'Z01-'))
+		else:
+			name = 'RES' if code < 0xc0 else 'SET'
+			table.append((code, name, (str(bit), target), 2, 16 if memory else 8, '----'))
+	return [Opcode(*entry) for entry in table]
+
+
+BASE = _base()
+CB = _cb()
+
+
+def decode(read8, addr):
+	code = read8(addr)
+	if code == 0xcb:
+		return CB[read8((addr + 1) & 0xffff)], True
+	return BASE[code], False
+
+
+###
+# Code generation
+#
+# Instruction bodies are Python source written against local variables named
+# after the registers (A, F, B, C, D, E, H, L, SP) plus read8/write8/
+# read16/write16 (and write16_high_first, for pushes) and the alu tables.
+# Immediates and the fall-through address are left as {d8}, {d16}, {r8} and
+# {next} placeholders, so the same body can be specialized either for the
+# per-opcode interpreter handlers below or for straight-line translated
+# blocks with the operands baked in as constants.
+# Control flow bodies assign PC on every path; conditional ones also assign
+# the number of cycles they took to `cycles`.
+###
+
+_CONDITIONS = {
+	'NZ': 'not F & 0x80',
+	'Z': 'F & 0x80',
+	'NC': 'not F & 0x10',
+	'C': 'F & 0x10',
+}
+
+_PAIRS = {
+	'BC': ('B', 'C'),
+	'DE': ('D', 'E'),
+	'HL': ('H', 'L'),
+	'AF': ('A', 'F'),
+}
+
+_REGISTERS = ('A', 'F', 'B', 'C', 'D', 'E', 'H', 'L', 'SP')
+
+JUMPS = ('JR', 'JP', 'CALL', 'RET', 'RETI', 'RST')
+
+# Instructions that wait for an interrupt and take a variable number of
+# cycles, which their bodies assign to `cycles`
+WAITS = ('HALT', 'STOP')
+
+
+def _load8(operand):
+	if operand in ('A', 'B', 'C', 'D', 'E', 'H', 'L'):
+		return operand
+	elif operand == '(HL)':
+		return 'read8((H << 8) | L)'
+	elif operand == '(BC)':
+		return 'read8((B << 8) | C)'
+	elif operand == '(DE)':
+		return 'read8((D << 8) | E)'
+	elif operand == '(C)':
+		return 'read8(0xff00 | C)'
+	elif operand == '(a8)':
+		return 'read8(0xff00 | {d8})'
+	elif operand == '(a16)':
+		return 'read8({d16})'
+	elif operand == 'd8':
+		return '{d8}'
+
+
+def _store8(operand, value):
+	if operand in ('A', 'B', 'C', 'D', 'E', 'H', 'L'):
+		return [operand + ' = ' + value]
+	elif operand == '(HL)':
+		return ['write8((H << 8) | L, ' + value + ')']
+	elif operand == '(BC)':
+		return ['write8((B << 8) | C, ' + value + ')']
+	elif operand == '(DE)':
+		return ['write8((D << 8) | E, ' + value + ')']
+	elif operand == '(C)':
+		return ['write8(0xff00 | C, ' + value + ')']
+	elif operand == '(a8)':
+		return ['write8(0xff00 | {d8}, ' + value + ')']
+	elif operand == '(a16)':
+		return ['write8({d16}, ' + value + ')']
+
+
+def _load16(operand):
+	if operand == 'SP':
+		return 'SP'
+	high, low = _PAIRS[operand]
+	return '((' + high + ' << 8) | ' + low + ')'
+
+
+def _store16(operand, value):
+	if operand == 'SP':
+		return ['SP = ' + value]
+	high, low = _PAIRS[operand]
+	return [
+		'value = ' + value,
+		high + ' = value >> 8',
+		low + ' = value & 0xff',
+	]
+
+
+def _push(value):
+	return [
+		'SP = (SP - 2) & 0xffff',
+		'write16_high_first(SP, ' + value + ')',
+	]
+
+
+def _pop(target):
+	return [
+		target + ' = read16(SP)',
+		'SP = (SP + 2) & 0xffff',
+	]
+
+
+def _conditional(opcode, condition, taken):
+	taken_cycles, not_taken_cycles = opcode.cycles
+	lines = ['if ' + _CONDITIONS[condition] + ':']
+	lines += ['\t' + line for line in taken]
+	lines += [
+		'\tcycles = ' + str(taken_cycles),
+		'else:',
+		'\tPC = {next}',
+		'\tcycles = ' + str(not_taken_cycles),
+	]
+	return lines
+
+
+def _ld(opcode):
+	dst, src = opcode.operands
+	if dst in ('BC', 'DE', 'HL', 'SP'):
+		if src == 'd16':
+			return _store16(dst, '{d16}')
+		elif src == 'HL':
+			return ['SP = (H << 8) | L']
+		elif src == 'SP+r8':
+			return [
+				'offset = {r8}',
+				'F = (0x20 if (SP & 0xf) + (offset & 0xf) > 0xf else 0) | (0x10 if (SP & 0xff) + (offset & 0xff) > 0xff else 0)',
+			] + _store16('HL', '(SP + offset) & 0xffff')
+	elif src == 'SP':
+		return [
+			'write16({d16}, SP)',
+		]
+	elif src in ('(HL+)', '(HL-)'):
+		step = '1' if src == '(HL+)' else '0xffff'
+		return [
+			'value = (H << 8) | L',
+			dst + ' = read8(value)',
+			'value = (value + ' + step + ') & 0xffff',
+			'H = value >> 8',
+			'L = value & 0xff',
+		]
+	elif dst in ('(HL+)', '(HL-)'):
+		step = '1' if dst == '(HL+)' else '0xffff'
+		return [
+			'value = (H << 8) | L',
+			'write8(value, ' + src + ')',
+			'value = (value + ' + step + ') & 0xffff',
+			'H = value >> 8',
+			'L = value & 0xff',
+		]
+	elif dst == src:
+		return []
+	return _store8(dst, _load8(src))
+
+
+def _inc_dec(opcode):
+	operand = opcode.operands[0]
+	step = '1' if opcode.mnemonic == 'INC' else '0xffff'
+	if operand in ('BC', 'DE', 'HL', 'SP'):
+		return _store16(operand, '(' + _load16(operand) + ' + ' + step + ') & 0xffff')
+	table = opcode.mnemonic
+	if operand == '(HL)':
+		return [
+			'addr = (H << 8) | L',
+			'entry = ' + table + '[read8(addr)]',
+			'write8(addr, entry & 0xff)',
+			'F = (entry >> 8) | (F & 0x10)',
+		]
+	return [
+		'entry = ' + table + '[' + operand + ']',
+		operand + ' = entry & 0xff',
+		'F = (entry >> 8) | (F & 0x10)',
+	]
+
+
+def _alu(opcode):
+	dst, src = opcode.operands
+	if dst == 'HL':
+		return [
+			'hl = (H << 8) | L',
+			'value = ' + _load16(src),
+			'F = (F & 0x80) | (0x20 if (hl & 0xfff) + (value & 0xfff) > 0xfff else 0) | (0x10 if hl + value > 0xffff else 0)',
+		] + _store16('HL', '(hl + value) & 0xffff')
+	elif dst == 'SP':
+		return [
+			'offset = {r8}',
+			'F = (0x20 if (SP & 0xf) + (offset & 0xf) > 0xf else 0) | (0x10 if (SP & 0xff) + (offset & 0xff) > 0xff else 0)',
+			'SP = (SP + offset) & 0xffff',
+		]
+	mnemonic = opcode.mnemonic
+	if mnemonic in ('ADC', 'SBC'):
+		table = 'ADD' if mnemonic == 'ADC' else 'SUB'
+		index = '((F & 0x10) << 12) | (A << 8) | ' + _load8(src)
+	else:
+		table = 'SUB' if mnemonic == 'CP' else mnemonic
+		index = '(A << 8) | ' + _load8(src)
+	if mnemonic == 'CP':
+		return ['F = ' + table + '[' + index + '] >> 8']
+	return [
+		'entry = ' + table + '[' + index + ']',
+		'A = entry & 0xff',
+		'F = entry >> 8',
+	]
+
+
+def _rotate_a(opcode):
+	table = {'RLCA': 'RLC', 'RRCA': 'RRC', 'RLA': 'RL', 'RRA': 'RR'}[opcode.mnemonic]
+	return [
+		'entry = ' + table + '[((F & 0x10) << 4) | A]',
+		'A = entry & 0xff',
+		'F = (entry >> 8) & 0x10',
+	]
+
+
+def _jump(opcode):
+	mnemonic = opcode.mnemonic
+	operands = opcode.operands
+	condition = operands[0] if operands and operands[0] in _CONDITIONS else None
+	if mnemonic == 'JR':
+		taken = ['PC = ({next} + {r8}) & 0xffff']
+	elif mnemonic == 'JP':
+		taken = ['PC = (H << 8) | L'] if operands == ('HL',) else ['PC = {d16}']
+	elif mnemonic == 'CALL':
+		taken = _push('{next}') + ['PC = {d16}']
+	elif mnemonic == 'RST':
+		taken = _push('{next}') + ['PC = ' + hex(int(operands[0][:-1], 16))]
+	elif mnemonic == 'RET':
+		taken = _pop('PC')
+	elif mnemonic == 'RETI':
+		taken = _pop('PC') + ['cpu._enable_interrupts(0)']
+	if condition:
+		return _conditional(opcode, condition, taken)
+	return taken
+
+
+def _cb_body(opcode):
+	mnemonic = opcode.mnemonic
+	target = opcode.operands[-1]
+	lines = []
+	if target == '(HL)':
+		lines.append('addr = (H << 8) | L')
+		value = 'read8(addr)'
+	else:
+		value = target
+	if mnemonic == 'BIT':
+		mask = hex(1 << int(opcode.operands[0]))
+		return lines + ['F = (F & 0x10) | (0x20 if ' + value + ' & ' + mask + ' else 0xa0)']
+	if mnemonic == 'RES':
+		result = value + ' & ' + hex(~(1 << int(opcode.operands[0])) & 0xff)
+	elif mnemonic == 'SET':
+		result = value + ' | ' + hex(1 << int(opcode.operands[0]))
+	else:
+		carry = '((F & 0x10) << 4) | ' if mnemonic in ('RL', 'RR') else ''
+		lines += [
+			'entry = ' + mnemonic + '[' + carry + value + ']',
+			'F = entry >> 8',
+		]
+		result = 'entry & 0xff'
+	if target == '(HL)':
+		return lines + ['write8(addr, ' + result + ')']
+	return lines + [target + ' = ' + result]
+
+
+def body(opcode, prefixed=False):
+	if prefixed:
+		return _cb_body(opcode)
+	mnemonic = opcode.mnemonic
+	if mnemonic in ('LD', 'LDH'):
+		return _ld(opcode)
+	elif mnemonic in ('INC', 'DEC'):
+		return _inc_dec(opcode)
+	elif mnemonic in _ALU:
+		return _alu(opcode)
+	elif mnemonic in ('RLCA', 'RRCA', 'RLA', 'RRA'):
+		return _rotate_a(opcode)
+	elif mnemonic in JUMPS:
+		return _jump(opcode)
+	elif mnemonic == 'PUSH':
+		return _push(_load16(opcode.operands[0]))
+	elif mnemonic == 'POP':
+		if opcode.operands[0] == 'AF':
+			return _pop('value') + ['A = value >> 8', 'F = value & 0xf0']
+		return _pop('value') + _store16(opcode.operands[0], 'value')[1:]
+	elif mnemonic == 'NOP':
+		return []
+	elif mnemonic == 'DAA':
+		return [
+			'entry = DAA[((F >> 4) << 8) | A]',
+			'A = entry & 0xff',
+			'F = entry >> 8',
+		]
+	elif mnemonic == 'CPL':
+		return ['A = A ^ 0xff', 'F = F | 0x60']
+	elif mnemonic == 'SCF':
+		return ['F = (F & 0x80) | 0x10']
+	elif mnemonic == 'CCF':
+		return ['F = (F & 0x90) ^ 0x10']
+	elif mnemonic == 'DI':
+		return ['cpu._interrupts_enabled = False']
+	elif mnemonic == 'EI':
+		# EI takes effect after the instruction that follows it
+		return ['cpu._enable_interrupts(5)']
+	elif mnemonic == 'HALT':
+		return ['cycles = cpu._halt()']
+	elif mnemonic == 'STOP':
+		return ['cycles = cpu._stop()']
+	# The illegal opcodes
+	return ['raise UnimplementedInstructionException(' + hex(opcode.code) + ')']
+
+
+# Returns the registers a body reads and the registers it assigns. A register
+# that is only ever assigned does not need loading first.
+def registers_used(lines):
+	names = '|'.join(_REGISTERS)
+	source = '\n'.join(lines)
+	written = set(re.findall(r'^\s*(' + names + r') = ', source, re.M))
+	read = set(re.findall(r'\b(' + names + r')\b', re.sub(r'^(\s*)(' + names + r') = ', r'\1', source, flags=re.M)))
+	return [name for name in _REGISTERS if name in read], [name for name in _REGISTERS if name in written]
+
+
+###
+# Flags
+#
+# Bit masks of the flags an instruction sets and the flags it actually uses,
+# for working out which flag updates anything ever looks at. Flags an
+# instruction leaves alone pass straight through and don't count as used.
+###
+
+_FLAG_BITS = (0x80, 0x40, 0x20, 0x10)
+
+_CONDITION_FLAGS = {'NZ': 0x80, 'Z': 0x80, 'NC': 0x10, 'C': 0x10}
+
+
+def flags_written(opcode):
+	mask = 0
+	for bit, effect in zip(_FLAG_BITS, opcode.flags):
+		if effect != '-':
+			mask |= bit
+	return mask
+
+
+def flags_read(opcode):
+	mnemonic = opcode.mnemonic
+	operands = opcode.operands
+	if operands and operands[0] in _CONDITION_FLAGS and mnemonic in JUMPS:
+		return _CONDITION_FLAGS[operands[0]]
+	elif mnemonic in ('ADC', 'SBC', 'RLA', 'RRA', 'RL', 'RR', 'CCF'):
+		return 0x10
+	elif mnemonic == 'DAA':
+		return 0x70
+	elif mnemonic == 'PUSH' and operands == ('AF',):
+		return 0xf0
+	return 0
+
+
+# Drops the flag update from a body whose flags nobody reads
+def without_flags(lines):
+	return [line for line in lines if not line.startswith('F = ')]
+
+
+def _handler(name, opcode, lines):
+	length = opcode.length
+	jumps = opcode.mnemonic in JUMPS
+	loads, stores = registers_used(lines)
+	source = '\n'.join(lines).format(
+		d8='read8((PC + 1) & 0xffff)',
+		d16='read16((PC + 1) & 0xffff)',
+		r8='((read8((PC + 1) & 0xffff) ^ 0x80) - 0x80)',
+		next='((PC + ' + str(length) + ') & 0xffff)',
+	)
+	idle = opcode.mnemonic == 'JR'
+	out = ['def ' + name + '():', '\tPC = origin = r.pc' if idle else '\tPC = r.pc']
+	out += ['\t' + register + ' = r.' + register.lower() for register in loads]
+	out += ['\t' + line for line in source.split('\n') if line]
+	out += ['\tr.' + register.lower() + ' = ' + register for register in stores]
+	if jumps:
+		out.append('\tr.pc = PC')
+	else:
+		out.append('\tr.pc = (PC + ' + str(length) + ') & 0xffff')
+	if isinstance(opcode.cycles, tuple) or opcode.mnemonic in WAITS:
+		cycles = 'cycles'
+	else:
+		cycles = str(opcode.cycles)
+	if idle:
+		out += idle_check('origin', cycles)
+	out.append('\treturn ' + cycles)
+	return out
+
+
+# Lines that hand a backward JR at `origin` to the CPU to check for an idle
+# loop, unless that JR is already known not to be one
+def idle_check(origin, cycles):
+	return [
+		'\tif PC <= ' + origin + ' and not busy_loops[' + origin + ']:',
+		'\t\treturn cpu._idle_loop(PC, ' + origin + ', ' + cycles + ')',
+	]
+
+
+def _factory_source():
+	lines = ['def factory(cpu, r, read8, write8, read16, write16, write16_high_first, busy_loops):']
+	names = []
+	for opcode in BASE:
+		name = '_ins_' + hex(opcode.code)
+		names.append(name)
+		if opcode.mnemonic == 'PREFIX':
+			handler = [
+				'def ' + name + '():',
+				'\treturn cb[read8((r.pc + 1) & 0xffff)]()',
+			]
+		else:
+			handler = _handler(name, opcode, body(opcode))
+		lines += ['\t' + line for line in handler]
+	cb_names = []
+	for opcode in CB:
+		name = '_ins_cb_' + hex(opcode.code)
+		cb_names.append(name)
+		lines += ['\t' + line for line in _handler(name, opcode, body(opcode, True))]
+	lines.append('\tcb = [' + ', '.join(cb_names) + ']')
+	lines.append('\treturn [' + ', '.join(names) + '], cb')
+	return '\n'.join(lines) + '\n'
+
+
+def namespace():
+	names = {'UnimplementedInstructionException': UnimplementedInstructionException}
+	for table in ('ADD', 'SUB', 'AND', 'XOR', 'OR', 'INC', 'DEC', 'DAA',
+			'RLC', 'RRC', 'RL', 'RR', 'SLA', 'SRA', 'SWAP', 'SRL'):
+		names[table] = getattr(alu, table)
+	return names
+
+
+_factory = None
+
+
+def build_handlers(cpu, registers, mmu):
+	global _factory
+	if _factory is None:
+		scope = namespace()
+		exec(compile(_factory_source(), '<opcodes>', 'exec'), scope)
+		_factory = scope['factory']
+	return _factory(cpu, registers, mmu.read8, mmu.write8, mmu.read16, mmu.write16, mmu.write16_high_first,
+			cpu.busy_loops)
@@ -0,0 +1,133 @@
+from array import array
+from opcodes import BASE, CB, decode
+
+# Counters kept per ROM bank, plus one at RAM_BANK for code running from RAM
+BANKS = 0x200
+RAM_BANK = BANKS
+
+# What each base opcode does to the call stack, for the profiling loop
+BRANCH_NONE = 0
+BRANCH_CALL = 1
+BRANCH_RST = 2
+BRANCH_RET = 3
+BRANCHES = bytearray(0x100)
+for _opcode in BASE:
+	if _opcode.mnemonic == 'CALL':
+		BRANCHES[_opcode.code] = BRANCH_CALL
+	elif _opcode.mnemonic == 'RST':
+		BRANCHES[_opcode.code] = BRANCH_RST
+	elif _opcode.mnemonic in ('RET', 'RETI'):
+		BRANCHES[_opcode.code] = BRANCH_RET
+
+
+def _counters(size):
+	return array('Q', bytes(8 * size))
+
+
+def _describe(opcode):
+	return (opcode.mnemonic + ' ' + ','.join(opcode.operands)).rstrip()
+
+
+def _percent(part, whole):
+	return '%6.2f%%' % (100.0 * part / whole if whole else 0)
+
+
+# Execution counts and cycles per opcode (CB opcodes at 0x100 + code), per PC
+# and per ROM bank, plus cycles per call stack for flame graphs. The CPU
+# fills these in from its profiling loop, which it only runs when given a
+# profiler, so unprofiled runs don't pay for any of it.
+#
+# Call stacks follow CALL, RST and interrupts in, and RET and RETI back out.
+# Each frame remembers the SP its return address was pushed at, so code that
+# drops a return address and jumps elsewhere unwinds properly at the next RET
+# further up.
+class Profiler():
+	def __init__(self, mmu):
+		self._mmu = mmu
+		self.opcode_counts = _counters(0x200)
+		self.opcode_cycles = _counters(0x200)
+		self.pc_counts = _counters(0x10000)
+		self.pc_cycles = _counters(0x10000)
+		self.bank_counts = _counters(BANKS + 1)
+		self.bank_cycles = _counters(BANKS + 1)
+		# Cycles per collapsed stack ('outer;inner;innermost')
+		self.stacks = {}
+		self.stack = 'start'
+		self._frames = []
+		# Where the last profiled instruction left PC, to spot interrupts
+		self.expected_pc = None
+
+
+	def frame_name(self, addr):
+		if addr < 0x4000 and self._mmu.rom_bank0:
+			return '%02x:%04x' % (self._mmu.rom_bank0, addr)
+		elif 0x4000 <= addr < 0x8000:
+			return '%02x:%04x' % (self._mmu.rom_bank, addr)
+		return '%04x' % addr
+
+
+	def call(self, target, sp):
+		self._frames.append((sp, self.stack))
+		self.stack += ';' + self.frame_name(target)
+
+
+	def ret(self, sp):
+		frames = self._frames
+		while frames and frames[-1][0] < sp:
+			self.stack = frames.pop()[1]
+
+
+	def add_stack_cycles(self, cycles):
+		self.stacks[self.stack] = self.stacks.get(self.stack, 0) + cycles
+
+
+	###
+	# Exporters
+	###
+
+	# Writes the `top` hottest PCs and opcodes by cycles, then every bank that
+	# ran anything
+	def write_report(self, out, top=30):
+		total = sum(self.pc_cycles)
+		print('Profile: ' + str(sum(self.pc_counts)) + ' instructions, ' + str(total) + ' cycles', file=out)
+
+		print('\nHot spots', file=out)
+		print('  addr        count       cycles   share  instruction', file=out)
+		pcs = sorted((addr for addr in range(0x10000) if self.pc_counts[addr]),
+				key=lambda addr: self.pc_cycles[addr], reverse=True)
+		for addr in pcs[:top]:
+			opcode, _ = decode(self._mmu.read8, addr)
+			print('  %04x %12d %12d %s  %s' % (addr, self.pc_counts[addr], self.pc_cycles[addr],
+					_percent(self.pc_cycles[addr], total), _describe(opcode)), file=out)
+
+		print('\nOpcodes', file=out)
+		print('  code        count       cycles   share  instruction', file=out)
+		codes = sorted((code for code in range(0x200) if self.opcode_counts[code]),
+				key=lambda code: self.opcode_cycles[code], reverse=True)
+		for code in codes[:top]:
+			opcode = CB[code & 0xff] if code & 0x100 else BASE[code]
+			print('  %s %12d %12d %s  %s' % (('cb%02x' if code & 0x100 else '  %02x') % (code & 0xff),
+					self.opcode_counts[code], self.opcode_cycles[code], _percent(self.opcode_cycles[code], total),
+					_describe(opcode)), file=out)
+
+		print('\nBanks', file=out)
+		print('  bank        count       cycles   share', file=out)
+		for bank in range(BANKS + 1):
+			if self.bank_counts[bank]:
+				print('  %4s %12d %12d %s' % ('RAM' if bank == RAM_BANK else '%02x' % bank,
+						self.bank_counts[bank], self.bank_cycles[bank], _percent(self.bank_cycles[bank], total)), file=out)
+
+
+	# Writes cycles per call stack in the collapsed format flamegraph.pl and
+	# speedscope read
+	def write_collapsed(self, out):
+		for stack, cycles in sorted(self.stacks.items()):
+			print(stack + ' ' + str(cycles), file=out)
+
+
+	# Writes PREFIX.txt (the report) and PREFIX.folded (the collapsed stacks)
+	def save(self, prefix):
+		with open(prefix + '.txt', 'w') as out:
+			self.write_report(out)
+		with open(prefix + '.folded', 'w') as out:
+			self.write_collapsed(out)
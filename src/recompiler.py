@@ -0,0 +1,135 @@
+from opcodes import (decode, body, registers_used, namespace, idle_check, flags_read,
+	flags_written, without_flags, JUMPS, WAITS)
+
+# Longest run of instructions translated into a single block
+MAX_BLOCK_LENGTH = 64
+
+# Instructions that need the interpreter (they raise or stop the CPU), and
+# instructions after which pending interrupts must be checked
+_UNTRANSLATED = WAITS + ('ILLEGAL',)
+_BLOCK_ENDS = JUMPS + ('EI', 'DI')
+
+
+# Translates straight-line runs of guest code into Python functions. Each
+# block keeps the registers in locals from its first instruction to its
+# last, bakes immediates in as constants, and returns the total number of
+# cycles it took. Blocks are cached by (ROM bank, PC) and thrown away as soon
+# as the MMU sees a write to a page they were translated from.
+#
+# With lazy_flags, flag updates that are overwritten inside the block before
+# anything reads them are left out. F is still exact whenever a block exits,
+# so nothing outside ever sees the difference.
+class Recompiler():
+	def __init__(self, cpu, registers, mmu, lazy_flags=False):
+		self._mmu = mmu
+		self._lazy_flags = lazy_flags
+		self._blocks = {}
+		self._pages = {}
+		self._scope = namespace()
+		self._scope.update({
+			'cpu': cpu,
+			'r': registers,
+			'read8': mmu.read8,
+			'write8': mmu.write8,
+			'read16': mmu.read16,
+			'write16': mmu.write16,
+			'write16_high_first': mmu.write16_high_first,
+			'busy_loops': cpu.busy_loops,
+		})
+
+
+	# Returns (function, instruction count) for the block starting at pc, or
+	# None if the instruction there has to go through the interpreter.
+	def block(self, pc):
+		if pc < 0x4000:
+			key = (self._mmu.rom_bank0, pc)
+		elif pc < 0x8000:
+			key = (self._mmu.rom_bank, pc)
+		else:
+			key = (0, pc)
+		try:
+			return self._blocks[key]
+		except KeyError:
+			block = self._translate(key, pc)
+			self._blocks[key] = block
+			return block
+
+
+	def invalidate(self, addr):
+		for key in self._pages.pop(addr >> 8, ()):
+			self._blocks.pop(key, None)
+
+
+	def _translate(self, key, pc):
+		read8 = self._mmu.read8
+		decoded = []
+		pages = set()
+		cycles = 0
+		count = 0
+		addr = pc
+		jumped = False
+		conditional = False
+		while count < MAX_BLOCK_LENGTH:
+			opcode, prefixed = decode(read8, addr)
+			last = addr
+			if opcode.mnemonic in _UNTRANSLATED:
+				break
+			following = (addr + opcode.length) & 0xffff
+			values = {'next': hex(following)}
+			if not prefixed and opcode.length > 1:
+				d8 = read8((addr + 1) & 0xffff)
+				values['d8'] = hex(d8)
+				values['r8'] = '(' + str(d8 - 256 if d8 > 127 else d8) + ')'
+				if opcode.length > 2:
+					values['d16'] = hex(d8 | (read8((addr + 2) & 0xffff) << 8))
+			decoded.append((opcode, prefixed, values))
+			for offset in range(opcode.length):
+				pages.add(((addr + offset) & 0xffff) >> 8)
+			count += 1
+			if isinstance(opcode.cycles, tuple):
+				conditional = True
+			else:
+				cycles += opcode.cycles
+			addr = following
+			if opcode.mnemonic in _BLOCK_ENDS:
+				jumped = opcode.mnemonic in JUMPS
+				break
+			# Don't run on into a different ROM bank or out of ROM
+			if addr & 0x3fff == 0:
+				break
+		if count == 0:
+			return None
+
+		# Walk back from the end, where every flag is live, to find the
+		# instructions whose flags are all overwritten unread
+		keep = []
+		live = 0xf0
+		for opcode, prefixed, values in reversed(decoded):
+			written = flags_written(opcode)
+			keep.append(not self._lazy_flags or not written or written & live)
+			live = (live & ~written) | flags_read(opcode)
+		keep.reverse()
+		lines = []
+		for (opcode, prefixed, values), flags in zip(decoded, keep):
+			instruction = body(opcode, prefixed)
+			if not flags:
+				instruction = without_flags(instruction)
+			lines += [line.format(**values) for line in instruction]
+
+		loads, stores = registers_used(lines)
+		name = '_block_' + hex(pc)
+		source = ['def ' + name + '():']
+		source += ['\t' + register + ' = r.' + register.lower() for register in loads]
+		source += ['\t' + line for line in lines]
+		source += ['\tr.' + register.lower() + ' = ' + register for register in stores]
+		source.append('\tr.pc = ' + ('PC' if jumped else hex(addr)))
+		total = str(cycles) + (' + cycles' if conditional else '')
+		if jumped and opcode.mnemonic == 'JR':
+			source += idle_check(hex(last), total)
+		source.append('\treturn ' + total)
+		exec(compile('\n'.join(source) + '\n', '<block ' + hex(pc) + '>', 'exec'), self._scope)
+
+		for page in pages:
+			self._pages.setdefault(page, set()).add(key)
+			self._mmu.watch_code(page, self.invalidate)
+		return self._scope.pop(name), count
@@ -0,0 +1,71 @@
+import random
+from sys import argv
+from gameboy import GameBoy
+from opcodes import BASE, CB, JUMPS, WAITS
+
+_REGISTERS = ('a', 'f', 'b', 'c', 'd', 'e', 'h', 'l', 'sp', 'pc')
+
+# Straight-line instructions only: anything that jumps, waits or changes
+# interrupt handling would end the program somewhere other than its end
+_POOL = [opcode for opcode in BASE if opcode.mnemonic not in JUMPS + WAITS + ('EI', 'DI', 'ILLEGAL', 'PREFIX')]
+
+
+# A random straight-line program of base and CB instructions, ending in HALT
+def _program(rnd):
+	program = []
+	for _ in range(rnd.randrange(1, 60)):
+		if rnd.random() < 0.2:
+			program += [0xcb, rnd.choice(CB).code]
+			continue
+		opcode = rnd.choice(_POOL)
+		program.append(opcode.code)
+		program += [rnd.randrange(256) for _ in range(opcode.length - 1)]
+	return program + [0x76]
+
+
+# Runs `program` from 0x100 to its HALT on a fresh machine, with work RAM and
+# registers filled in from `seed`, and returns the registers, the cycle count
+# and all memory outside the I/O registers
+def _run(program, seed, recompile):
+	gameboy = GameBoy(recompile=recompile)
+	mmu = gameboy._mmu
+	mmu._rom[0x100:0x100 + len(program)] = bytes(program)
+	rnd = random.Random(seed)
+	for addr in range(0xc000, 0xe000):
+		mmu.write8(addr, rnd.randrange(256))
+	r = gameboy._cpu._registers
+	r.a, r.f, r.b, r.c, r.d, r.e, r.l = [rnd.randrange(256) for _ in range(7)]
+	r.f &= 0xf0
+	# HL and SP point into work RAM, so (HL) and the stack stay in it
+	r.h, r.sp = 0xc8, 0xdff0
+	end = 0x100 + len(program) - 1
+	while r.pc < end:
+		gameboy._cpu.tick()
+	memory = bytes(mmu.read8(addr) for addr in range(0x10000) if not 0xff00 <= addr < 0xff80)
+	return tuple(getattr(r, name) for name in _REGISTERS) + (gameboy._scheduler.now, memory)
+
+
+# Differential check of the recompiler against the interpreter. Runs random
+# straight-line programs for seeds 0 to `programs` - 1 both ways and returns
+# a description of the first that ends differently, or None if all match.
+def compare(programs):
+	for seed in range(programs):
+		program = _program(random.Random(seed))
+		expected = _run(program, seed, False)
+		actual = _run(program, seed, True)
+		if expected != actual:
+			differing = [name for name, value, wanted in zip(_REGISTERS + ('now', 'memory'), actual, expected)
+					if value != wanted]
+			return 'Program ' + str(seed) + ' (' + bytes(program).hex() + ') left ' + ', '.join(differing) + ' different'
+	return None
+
+
+def main():
+	programs = int(argv[1]) if len(argv) > 1 else 200
+	result = compare(programs)
+	print(result or 'Recompiled code matched the interpreter for ' + str(programs) + ' programs')
+	return result is None
+
+
+if __name__ == '__main__':
+	exit(0 if main() else 1)
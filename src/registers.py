@@ -0,0 +1,15 @@
+class Registers():
+	__slots__ = ('a', 'f', 'b', 'c', 'd', 'e', 'h', 'l', 'sp', 'pc')
+
+	def __init__(self):
+		self.a = 0x01
+		self.f = 0xb0
+		self.b = 0
+		self.c = 0x13
+		self.d = 0
+		self.e = 0xd8
+		self.h = 0x01
+		self.l = 0x4d
+		self.sp = 0xfffe
+		self.pc = 0x100
+
@@ -0,0 +1,230 @@
+# Screen size in pixels
+WIDTH = 160
+HEIGHT = 144
+
+# Tiles at 0x8000-0x97ff, 16 bytes each
+TILE_COUNT = 384
+
+# _SPREAD[b] has bit 7 - i of b in the low bit of byte i, so a row's two bit
+# planes turn into eight colour indices, leftmost first, with a shift and an or
+_SPREAD = [sum(((b >> bit) & 1) << (8 * bit) for bit in range(8)) for b in range(256)]
+
+# Offsets into the decoded rows of the tile a map entry names: with LCDC bit 4
+# set tiles 0-255 start at 0x8000, and with it clear -128-127 start at 0x9000
+_UNSIGNED_TILES = [tile << 3 for tile in range(256)]
+_SIGNED_TILES = [(256 + ((tile ^ 0x80) - 0x80)) << 3 for tile in range(256)]
+
+
+# A palette register as a translate table from colour index to shade
+def _shades(value):
+	return bytes([(value >> ((index & 3) << 1)) & 3 for index in range(256)])
+
+
+# Draws the picture a line at a time, the background and window as runs of
+# whole tile rows and the sprites over them. Tiles are decoded once into rows
+# of colour indices and only decoded again after their VRAM is written, which
+# the MMU flags in `tiles_dirty`. The finished frame is one shade (0-3, white
+# to black) per pixel, each line put through its palette with one translate.
+#
+# A line is only drawn if something it's drawn from changed since the buffer
+# being drawn into last had that line: the registers, the map entries it
+# covers, the palettes, and the tiles and sprites, the last two by counting
+# decodes and sprite index rebuilds. Mostly static screens cost a key per
+# line.
+class Renderer():
+	def __init__(self, mmu):
+		self._mmu = mmu
+		self._vram = mmu.vram
+		self._oam = mmu.oam
+		self._dirty = mmu.tiles_dirty
+		self._oam_written = mmu.oam_written
+		# Row r of tile t is at (t << 3) | r, eight bytes of colour indices
+		self._rows = [bytes(8)] * (TILE_COUNT << 3)
+		# Which line of itself the window draws next
+		self._window_line = 0
+		# Sprites to draw on each line, in drawing order, as (x, OAM offset),
+		# for sprites `_index_height` tall and OAM as in `_indexed_oam`
+		self._line_sprites = [()] * HEIGHT
+		self._index_height = 0
+		self._indexed_oam = None
+		# Counts of tile decodes and sprite index rebuilds, and what each line
+		# was last drawn from for each buffer drawn into
+		self._tile_generation = 0
+		self._oam_generation = 0
+		self._keys = {}
+		# Translate tables from colour index to shade for BGP, OBP0 and OBP1,
+		# made again whenever one's written
+		self._bg_shades = _shades(mmu.read_io(0x47))
+		self._sprite_shades = (_shades(mmu.read_io(0x48)), _shades(mmu.read_io(0x49)))
+		mmu.io_handler(0x47, self._reg_bgp_set)
+		mmu.io_handler(0x48, self._reg_obp0_set)
+		mmu.io_handler(0x49, self._reg_obp1_set)
+		self.target(bytearray(WIDTH * HEIGHT))
+
+
+	def render_line(self, ly):
+		self._decode()
+		read_io = self._mmu.read_io
+		vram = self._vram
+		lcdc = read_io(0x40)
+		if ly == 0:
+			self._window_line = 0
+		y = (read_io(0x42) + ly) & 0xff
+		base = (0x1c00 if lcdc & 0x08 else 0x1800) | ((y >> 3) << 5)
+		# The window's own line count only goes up on lines it's drawn on
+		window = None
+		wx = read_io(0x4b)
+		if lcdc & 0x21 == 0x21 and read_io(0x4a) <= ly and wx < WIDTH + 7:
+			window = self._window_line
+			self._window_line += 1
+			window_base = (0x1c00 if lcdc & 0x40 else 0x1800) | ((window >> 3) << 5)
+			window = (window, wx, vram[window_base:window_base + 21])
+		sprites = 0
+		if lcdc & 0x02:
+			height = 16 if lcdc & 0x04 else 8
+			if self._oam_written[0] or height != self._index_height:
+				self._index_sprites(height)
+			if self._line_sprites[ly]:
+				sprites = self._oam_generation
+
+		key = (lcdc, y, read_io(0x43), vram[base:base + 32], window, sprites, self._tile_generation,
+				self._bg_shades, self._sprite_shades)
+		if key == self._line_keys[ly]:
+			return
+		self._line_keys[ly] = key
+		if lcdc & 0x01:
+			line = self._background(key)
+			out = line.translate(self._bg_shades)
+		else:
+			# The background and window are blank white when turned off
+			line = bytes(WIDTH)
+			out = bytearray(WIDTH)
+		if sprites:
+			self._sprites(ly, lcdc, line, out)
+		self.frame[ly * WIDTH:(ly + 1) * WIDTH] = out
+
+
+	# Draws from now on into `frame`, a bytearray of WIDTH * HEIGHT
+	def target(self, frame):
+		self.frame = frame
+		self._line_keys = self._keys.setdefault(id(frame), [None] * HEIGHT)
+
+
+	# Called at VBlank, once every visible line has been through render_line
+	def finish_frame(self):
+		pass
+
+
+	# Decodes every tile written since last time
+	def _decode(self):
+		dirty = self._dirty
+		tile = dirty.find(1)
+		while tile != -1:
+			dirty[tile] = 0
+			vram = self._vram
+			rows = self._rows
+			addr = tile << 4
+			for row in range(tile << 3, (tile + 1) << 3):
+				rows[row] = (_SPREAD[vram[addr]] | (_SPREAD[vram[addr + 1]] << 1)).to_bytes(8, 'big')
+				addr += 2
+			tile = dirty.find(1, tile + 1)
+			self._tile_generation += 1
+
+
+	# Colour indices of the background, with the window over it, for the line
+	# with key `key`: the map rows it covers are already in there
+	def _background(self, key):
+		lcdc, y, scx, entries, window = key[:5]
+		rows = self._rows
+		tiles = _UNSIGNED_TILES if lcdc & 0x10 else _SIGNED_TILES
+		row = y & 7
+		strip = b''.join([rows[tiles[tile] | row] for tile in entries])
+		# The map wraps around horizontally
+		line = bytearray((strip + strip)[scx:scx + WIDTH])
+		if window:
+			y, wx, entries = window
+			row = y & 7
+			strip = b''.join([rows[tiles[tile] | row] for tile in entries])
+			x = wx - 7
+			if x < 0:
+				line[:] = strip[-x:WIDTH - x]
+			else:
+				line[x:] = strip[:WIDTH - x]
+		return line
+
+
+	# Works out which sprites each line shows. Only the first ten in OAM that
+	# touch a line are drawn, and where they overlap the one further left
+	# wins, then the one earlier in OAM, which is the order they're kept in.
+	# Games copy OAM in every frame whether it changed or not, so a
+	# write only means a rebuild if the contents are different.
+	def _index_sprites(self, height):
+		self._oam_written[0] = 0
+		oam = bytes(self._oam[:0xa0])
+		if oam == self._indexed_oam and height == self._index_height:
+			return
+		self._indexed_oam = oam
+		self._index_height = height
+		self._oam_generation += 1
+		lines = [[] for _ in range(HEIGHT)]
+		for index in range(0, 0xa0, 4):
+			top = oam[index] - 16
+			for ly in range(max(top, 0), min(top + height, HEIGHT)):
+				if len(lines[ly]) < 10:
+					lines[ly].append((oam[index + 1], index))
+		for sprites in lines:
+			sprites.sort()
+		self._line_sprites = lines
+
+
+	# Draws the sprites on line `ly` into `out`, over background colour
+	# indices `line`. Each pixel goes to the highest priority sprite with a
+	# colour there, and only then does that sprite's BG-over-OBJ flag decide
+	# whether it shows, so a sprite behind the background hides the ones
+	# under it too.
+	def _sprites(self, ly, lcdc, line, out):
+		height = 16 if lcdc & 0x04 else 8
+		found = self._line_sprites[ly]
+		claimed = bytearray(WIDTH)
+		oam = self._oam
+		rows = self._rows
+		palettes = self._sprite_shades
+		for x, index in found:
+			flags = oam[index + 3]
+			row = ly - (oam[index] - 16)
+			if flags & 0x40:
+				row = height - 1 - row
+			tile = oam[index + 2] & 0xfe if height == 16 else oam[index + 2]
+			# Rows of consecutive tiles are consecutive, so row 8-15 of a tall
+			# sprite runs on into the second tile
+			pixels = rows[(tile << 3) + row]
+			if flags & 0x20:
+				pixels = pixels[::-1]
+			shades = palettes[(flags >> 4) & 1]
+			behind = flags & 0x80
+			x -= 8
+			for offset in range(max(0, -x), min(8, WIDTH - x)):
+				colour = pixels[offset]
+				if colour and not claimed[x + offset]:
+					claimed[x + offset] = 1
+					if not (behind and line[x + offset]):
+						out[x + offset] = shades[colour]
+
+
+	###
+	# Register access functions
+	###
+
+	def _reg_bgp_set(self, value):
+		self._mmu.write_io(0x47, value)
+		self._bg_shades = _shades(value)
+
+
+	def _reg_obp0_set(self, value):
+		self._mmu.write_io(0x48, value)
+		self._sprite_shades = (_shades(value), self._sprite_shades[1])
+
+
+	def _reg_obp1_set(self, value):
+		self._mmu.write_io(0x49, value)
+		self._sprite_shades = (self._sprite_shades[0], _shades(value))
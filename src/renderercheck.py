@@ -0,0 +1,159 @@
+import random
+from sys import argv
+from gameboy import GameBoy
+from display import NumpyRenderer, LINE_CYCLES
+
+
+# A machine spinning in JR -2 with VRAM, OAM and the LCD registers filled in
+# from `seed`, drawing with `renderer`
+def _machine(seed, renderer):
+	gameboy = GameBoy(renderer=renderer)
+	mmu = gameboy._mmu
+	mmu._rom[0x100:0x102] = b'\x18\xfe'
+	rnd = random.Random(seed)
+	for addr in range(0x8000, 0xa000):
+		mmu.write8(addr, rnd.randrange(256))
+	for addr in range(0xfe00, 0xfea0):
+		# Keep most sprites' Y on screen
+		mmu.write8(addr, rnd.randrange(170) if addr & 3 == 0 else rnd.randrange(256))
+	for reg in (0x42, 0x43, 0x47, 0x48, 0x49):
+		mmu.write8(0xff00 | reg, rnd.randrange(256))
+	mmu.write8(0xff4a, rnd.randrange(150))
+	mmu.write8(0xff4b, rnd.randrange(170))
+	mmu.write8(0xff40, 0x80 | rnd.randrange(128))
+	return gameboy
+
+
+# Runs until the display finishes a frame, and returns it
+def _frame(gameboy):
+	display = gameboy._display
+	count = display.frame_count
+	while display.frame_count == count:
+		gameboy._cpu.run_for(LINE_CYCLES)
+	return display.framebuffer.front.tobytes()
+
+
+# Changes the sprites between frames the ways games do: writes to OAM,
+# OAM DMA of new or unchanged tables, and switching sprite height
+def _change_sprites(rnd, mmu):
+	change = rnd.randrange(4)
+	if change == 0:
+		for _ in range(rnd.randrange(1, 8)):
+			mmu.write8(rnd.randrange(0xfe00, 0xfea0), rnd.randrange(256))
+	elif change == 1:
+		for addr in range(0xc000, 0xc0a0):
+			mmu.write8(addr, rnd.randrange(170) if addr & 3 == 0 else rnd.randrange(256))
+		mmu.write8(0xff46, 0xc0)
+	elif change == 2:
+		mmu.write8(0xff46, 0xc0)
+	else:
+		mmu.write8(0xff40, mmu.read8(0xff40) ^ 0x04)
+
+
+# Changes anything a line is drawn from, or nothing at all, which is what
+# most frames of a mostly still screen do
+def _change_picture(rnd, mmu):
+	change = rnd.randrange(8)
+	if change == 1:
+		mmu.write8(0xff00 | rnd.choice((0x42, 0x43, 0x4a, 0x4b)), rnd.randrange(256))
+	elif change == 2:
+		mmu.write8(rnd.randrange(0x9800, 0xa000), rnd.randrange(256))
+	elif change == 3:
+		mmu.write8(rnd.randrange(0x8000, 0x9800), rnd.randrange(256))
+	elif change == 4:
+		mmu.write8(0xff00 | rnd.choice((0x47, 0x48, 0x49)), rnd.randrange(256))
+	elif change == 5:
+		mmu.write8(0xff40, mmu.read8(0xff40) ^ (1 << rnd.randrange(7)))
+	elif change >= 6:
+		_change_sprites(rnd, mmu)
+
+
+def _describe(seed, frame, expected, actual):
+	differing = [i for i in range(len(expected)) if expected[i] != actual[i]]
+	y, x = divmod(differing[0], 160)
+	return ('Seed ' + str(seed) + ' frame ' + str(frame) + ' drew ' + str(len(differing)) +
+			' pixels differently, first at (' + str(x) + ', ' + str(y) + ')')
+
+
+# Differential check of the NumPy renderer against the line renderer. Draws
+# the picture for seeds 0 to `seeds` - 1 with both and returns a description
+# of the first that comes out differently, or None if all match.
+def compare_numpy(seeds):
+	for seed in range(seeds):
+		expected, actual = [_frame(_machine(seed, renderer)) for renderer in ('python', 'numpy')]
+		if expected != actual:
+			return _describe(seed, 0, expected, actual)
+	return None
+
+
+# Differential check of the line renderer's sprite index, which is only
+# rebuilt when OAM changes, against the same renderer made to rebuild it
+# every frame. Changes the sprites between each of `frames` frames for seeds
+# 0 to `seeds` - 1 and returns a description of the first frame that comes
+# out differently, or None if all match.
+def compare_sprite_index(seeds, frames=10):
+	for seed in range(seeds):
+		indexed, rebuilt = _machine(seed, 'python'), _machine(seed, 'python')
+		rnd = random.Random(seed)
+		for frame in range(frames):
+			state = rnd.getstate()
+			for gameboy in (indexed, rebuilt):
+				rnd.setstate(state)
+				_change_sprites(rnd, gameboy._mmu)
+			renderer = rebuilt._display._renderer
+			renderer._indexed_oam = None
+			renderer._oam_written[0] = 1
+			expected, actual = _frame(rebuilt), _frame(indexed)
+			if expected != actual:
+				return _describe(seed, frame, expected, actual)
+	return None
+
+
+# Differential check of drawing only what changed against drawing every
+# line of every frame, for `renderer`. Changes the picture between each of
+# `frames` frames for seeds 0 to `seeds` - 1 and returns a description of
+# the first frame that comes out differently, or None if all match.
+def compare_incremental(seeds, renderer='python', frames=20):
+	for seed in range(seeds):
+		incremental, full = _machine(seed, renderer), _machine(seed, renderer)
+		rnd = random.Random(seed)
+		for frame in range(frames):
+			state = rnd.getstate()
+			for gameboy in (incremental, full):
+				rnd.setstate(state)
+				_change_picture(rnd, gameboy._mmu)
+			# Forgetting what every buffer was drawn from redraws all of it
+			drawer = full._display._renderer
+			drawer._keys.clear()
+			if renderer == 'numpy':
+				drawer._frame_keys.clear()
+			drawer.target(drawer.frame)
+			expected, actual = _frame(full), _frame(incremental)
+			if expected != actual:
+				return _describe(seed, frame, expected, actual)
+	return None
+
+
+def main():
+	seeds = int(argv[1]) if len(argv) > 1 else 50
+	results = []
+	result = compare_sprite_index(seeds)
+	print(result or 'The sprite index matched rebuilding it every frame for ' + str(seeds) + ' seeds')
+	results.append(result)
+	renderers = ['python', 'numpy'] if NumpyRenderer else ['python']
+	for renderer in renderers:
+		result = compare_incremental(seeds, renderer)
+		print(result or 'Redrawing only what changed matched redrawing everything with the ' + renderer +
+				' renderer for ' + str(seeds) + ' seeds')
+		results.append(result)
+	if not NumpyRenderer:
+		print('NumPy isn\'t installed, so there\'s no NumPy renderer to check')
+		return not any(results)
+	result = compare_numpy(seeds)
+	print(result or 'The NumPy renderer matched the line renderer for ' + str(seeds) + ' seeds')
+	results.append(result)
+	return not any(results)
+
+
+if __name__ == '__main__':
+	exit(0 if main() else 1)
@@ -0,0 +1,51 @@
+import mmap
+import os
+import threading
+
+# Seconds between flushes of dirty battery RAM to the save file
+FLUSH_INTERVAL = 1.0
+
+
+# Battery-backed cartridge RAM, mapped straight from its .sav file so the OS
+# keeps the file up to date and a crash loses at most one flush interval.
+# Writes mark their 256-byte page in `dirty`; a background thread msyncs
+# just the dirty runs every `interval` seconds.
+class BatteryRAM():
+	def __init__(self, path, size, interval=FLUSH_INTERVAL):
+		self.path = path
+		self._file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+		if os.fstat(self._file.fileno()).st_size < size:
+			self._file.truncate(size)
+		self.data = mmap.mmap(self._file.fileno(), size)
+		self.dirty = bytearray((size + 0xff) >> 8)
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._flush_loop, args=(interval,), daemon=True)
+		self._thread.start()
+
+
+	def _flush_loop(self, interval):
+		while not self._stop.wait(interval):
+			self.flush()
+
+
+	# A page is marked clean before its range is synced, so a write that
+	# races the flush either makes it in or marks the page dirty again
+	def flush(self):
+		dirty = self.dirty
+		first = dirty.find(1)
+		while first != -1:
+			end = dirty.find(0, first)
+			if end == -1:
+				end = len(dirty)
+			dirty[first:end] = bytes(end - first)
+			# msync wants the start aligned to a host page
+			start = (first << 8) - (first << 8) % mmap.PAGESIZE
+			self.data.flush(start, min(end << 8, len(self.data)) - start)
+			first = dirty.find(1, end)
+
+
+	def close(self):
+		self._stop.set()
+		self._thread.join()
+		self.flush()
+		self._file.close()
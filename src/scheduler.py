@@ -0,0 +1,55 @@
+# Event slots. Each source of timed work owns one slot and keeps its next
+# deadline in it; a slot with no pending work sits at NEVER.
+EVENT_PPU = 0
+EVENT_TIMER = 1
+EVENT_SERIAL = 2
+EVENT_DMA = 3
+EVENT_HDMA = 4
+EVENT_INTERRUPT = 5
+EVENT_SLICE = 6
+EVENT_COUNT = 7
+
+NEVER = 1 << 62
+
+
+# Cycle-timestamped event queue. `now` is the absolute cycle count and
+# `deadline` the earliest pending event, so the CPU can run straight up to
+# `deadline` without asking anyone anything in between. With this few event
+# sources a fixed slot array is cheaper than a heap.
+class Scheduler():
+	__slots__ = ('now', 'deadline', '_deadlines', '_callbacks')
+
+	def __init__(self):
+		self.now = 0
+		self.deadline = NEVER
+		self._deadlines = [NEVER] * EVENT_COUNT
+		self._callbacks = [None] * EVENT_COUNT
+
+
+	def register(self, event, callback):
+		self._callbacks[event] = callback
+
+
+	# Callbacks receive the time the event was due, which can be slightly
+	# earlier than `now` if the instruction that crossed it overshot.
+	def schedule(self, event, when):
+		self._deadlines[event] = when
+		if when < self.deadline:
+			self.deadline = when
+		else:
+			self.deadline = min(self._deadlines)
+
+
+	def cancel(self, event):
+		self._deadlines[event] = NEVER
+		self.deadline = min(self._deadlines)
+
+
+	def run_due(self):
+		deadlines = self._deadlines
+		while self.deadline <= self.now:
+			when = self.deadline
+			event = deadlines.index(when)
+			deadlines[event] = NEVER
+			self.deadline = min(deadlines)
+			self._callbacks[event](when)
@@ -0,0 +1,36 @@
+from mmu import INT_SERIAL
+from scheduler import EVENT_SERIAL
+
+# 8 bits at 8192 Hz on the internal clock
+TRANSFER_CYCLES = 4096
+
+
+# Serial port with nothing plugged in: every transfer shifts in 0xff. Bytes
+# shifted out are kept in `output`, which is how test ROMs report results.
+class Serial():
+	def __init__(self, mmu, scheduler):
+		self._mmu = mmu
+		self._scheduler = scheduler
+		self.output = bytearray()
+		scheduler.register(EVENT_SERIAL, self._transfer_done)
+		mmu.io_handler(0x02, self._reg_sc_set)
+
+
+	def _transfer_done(self, when):
+		self.output.append(self._mmu.read_io(0x01))
+		self._mmu.write_io(0x01, 0xff)
+		self._mmu.write_io(0x02, self._mmu.read_io(0x02) & 0x7f)
+		self._mmu.request_interrupt(INT_SERIAL)
+
+
+	###
+	# Register access functions
+	###
+
+	def _reg_sc_set(self, value):
+		self._mmu.write_io(0x02, 0x7e | value)
+		# Only transfers on the internal clock ever finish without a peer
+		if value & 0x81 == 0x81:
+			self._scheduler.schedule(EVENT_SERIAL, self._scheduler.now + TRANSFER_CYCLES)
+		else:
+			self._scheduler.cancel(EVENT_SERIAL)
@@ -0,0 +1,82 @@
+from mmu import INT_TIMER
+from scheduler import EVENT_TIMER
+
+# DIV counts up every 256 cycles
+DIV_CYCLES = 256
+
+# Cycles per TIMA increment for each TAC clock select value
+_TIMA_CYCLES = (1024, 16, 64, 256)
+
+
+# DIV and TIMA are worked out from the cycle count when they're read rather
+# than counted up by events: DIV from when it was last reset, and TIMA from
+# the value it had when it last started counting. The only event is the one
+# at which TIMA overflows.
+class Timer():
+	def __init__(self, mmu, scheduler):
+		self._mmu = mmu
+		self._scheduler = scheduler
+		self._div_origin = scheduler.now
+		self._tima = mmu.read_io(0x05)
+		self._tima_origin = scheduler.now
+		scheduler.register(EVENT_TIMER, self._overflow)
+		mmu.io_handler(0x04, self._reg_div_set, self._reg_div)
+		mmu.io_handler(0x05, self._reg_tima_set, self._reg_tima)
+		mmu.io_handler(0x07, self._reg_tac_set)
+		self._restart_tima(scheduler.now)
+
+
+	# TMA is only looked at here, so it's a plain register
+	def _overflow(self, when):
+		self._tima = self._mmu.read_io(0x06)
+		self._mmu.request_interrupt(INT_TIMER)
+		self._restart_tima(when)
+
+
+	# Starts TIMA counting up from its current value at `when`, if enabled
+	def _restart_tima(self, when):
+		self._tima_origin = when
+		tac = self._mmu.read_io(0x07)
+		if tac & 0x04:
+			self._scheduler.schedule(EVENT_TIMER, when + (0x100 - self._tima) * _TIMA_CYCLES[tac & 3])
+		else:
+			self._scheduler.cancel(EVENT_TIMER)
+
+
+	###
+	# Register access functions
+	###
+
+	def _reg_div(self):
+		return ((self._scheduler.now - self._div_origin) >> 8) & 0xff
+
+
+	# Any write to DIV resets it, which also restarts the TIMA prescaler
+	def _reg_div_set(self, value):
+		now = self._scheduler.now
+		self._tima = self._reg_tima()
+		self._div_origin = now
+		self._restart_tima(now)
+
+
+	# The overflow event always fires before the count gets past 0xff
+	def _reg_tima(self):
+		tac = self._mmu.read_io(0x07)
+		if not tac & 0x04:
+			return self._tima
+		return self._tima + (self._scheduler.now - self._tima_origin) // _TIMA_CYCLES[tac & 3]
+
+
+	# Keeps the prescaler's phase, so the next increment comes when it would
+	# have anyway
+	def _reg_tima_set(self, value):
+		now = self._scheduler.now
+		self._tima = value
+		self._restart_tima(now - (now - self._tima_origin) % _TIMA_CYCLES[self._mmu.read_io(0x07) & 3])
+
+
+	def _reg_tac_set(self, value):
+		now = self._scheduler.now
+		self._tima = self._reg_tima()
+		self._mmu.write_io(0x07, 0xf8 | (value & 0x07))
+		self._restart_tima(now)
@@ -0,0 +1,100 @@
+import struct
+import sys
+from opcodes import BASE
+
+# Records kept by the ring buffer when no size is given
+RING_SIZE = 4096
+
+# One trace file record: PC, opcode, A, F, B, C, D, E, H, L, SP, little-endian
+RECORD = struct.Struct('<HBBBBBBBBBH')
+
+
+def _format(record):
+	pc, opcode, a, f, b, c, d, e, h, l, sp = record
+	ins = BASE[opcode]
+	return '%04x  %02x  %-5s%-12s A=%02x F=%02x BC=%02x%02x DE=%02x%02x HL=%02x%02x SP=%04x' % (
+		pc, opcode, ins.mnemonic, ','.join(ins.operands), a, f, b, c, d, e, h, l, sp)
+
+
+###
+# Tracers
+#
+# A tracer gets record(pc, opcode, registers) before every instruction runs.
+# The CPU only calls it from its tracing loop, which it picks once at start
+# up, so an untraced run has no trace code in its loop at all. crash() is
+# called if execution dies, and close() once the emulator stops.
+###
+
+# Keeps the last `size` instructions in memory and prints them if the CPU
+# crashes, so there is something to go on without writing out every step
+class RingTrace():
+	def __init__(self, size=RING_SIZE, out=None):
+		self._records = [None] * size
+		self._next = 0
+		self._out = out or sys.stderr
+
+
+	def record(self, pc, opcode, r):
+		i = self._next
+		self._records[i] = (pc, opcode, r.a, r.f, r.b, r.c, r.d, r.e, r.h, r.l, r.sp)
+		self._next = (i + 1) % len(self._records)
+
+
+	# Oldest first
+	def records(self):
+		i = self._next
+		return [record for record in self._records[i:] + self._records[:i] if record]
+
+
+	def crash(self):
+		self.dump()
+
+
+	def dump(self):
+		records = self.records()
+		print('Last ' + str(len(records)) + ' instructions:', file=self._out)
+		for record in records:
+			print(_format(record), file=self._out)
+
+
+	def close(self):
+		pass
+
+
+# Writes every instruction to a binary file of RECORD-sized records
+class FileTrace():
+	def __init__(self, path):
+		self._file = open(path, 'wb', buffering=1 << 20)
+		self._pack = RECORD.pack
+		self._write = self._file.write
+
+
+	def record(self, pc, opcode, r):
+		self._write(self._pack(pc, opcode, r.a, r.f, r.b, r.c, r.d, r.e, r.h, r.l, r.sp))
+
+
+	def crash(self):
+		self._file.flush()
+
+
+	def close(self):
+		self._file.close()
+
+
+# Reads a file written by FileTrace back as a list of record tuples
+def read_trace(path):
+	with open(path, 'rb') as f:
+		return list(RECORD.iter_unpack(f.read()))
+
+
+# Builds the tracer for a --trace option: 'off', 'ring', 'ring:SIZE' or
+# 'file:PATH'. Returns None for off.
+def make_tracer(spec):
+	level, _, arg = spec.partition(':')
+	if level == 'off':
+		return None
+	elif level == 'ring':
+		return RingTrace(int(arg) if arg else RING_SIZE)
+	elif level == 'file' and arg:
+		return FileTrace(arg)
+	raise ValueError('Unknown trace level ' + spec)